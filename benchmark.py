@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from xlsx_to_dictionary import get_form_metadata, iter_html, load_xlsform, process_survey, save_to_html, sheet_length, write_xlsx
+
+# Synthetic forms to benchmark; each runs every stage from workbook load to writing the HTML
+SCENARIOS = {
+    'rows-100': {'rows': 100},
+    'rows-1k': {'rows': 1000},
+    'rows-10k': {'rows': 10000},
+    'rows-100k': {'rows': 100000},
+    'deep-nesting': {'rows': 10000, 'depth': 10},
+    'many-references': {'rows': 10000, 'references': 20},
+    'translations': {'rows': 10000, 'languages': 5},
+    # A million choice rows would be repeated under every select question, so they are built in the browser
+    'large-choices': {'rows': 1000, 'choice_list_size': 100000, 'options': {'lazy_choices': True}}
+}
+
+# Scenarios run when none are named; the rest take minutes and gigabytes
+DEFAULT_SCENARIOS = ('rows-100', 'rows-1k', 'rows-10k', 'deep-nesting', 'many-references', 'translations')
+
+# Stages timed for each scenario, in the order they run
+STAGES = ('load', 'parse', 'render', 'write')
+
+# Smallest increase over the baseline counted as a regression, whatever the tolerance, so that
+# stages taking a millisecond or a few hundred KB do not fail on timer and allocator noise
+MIN_REGRESSION = {'seconds': 0.005, 'peak_mb': 1.0, 'held_mb': 1.0}
+
+# Function to build a synthetic survey/choices pair with nested groups, selects and relevance
+# depth nests each block of questions that many groups deep, references sets how many ${} names
+# each relevant expression uses and languages adds that many label::/hint:: translation columns
+def make_synthetic_form(rows, group_size=50, choice_list_size=20, depth=1, references=1, languages=0, choice_lists=10):
+    # Imported here so the processes that measure a scenario do not carry pandas in their memory
+    import pandas as pd
+
+    language_names = [f'Language {number}' for number in range(1, languages + 1)]
+    survey_rows = []
+    question_number = 0
+    group_number = 0
+    while len(survey_rows) < rows:
+        for level in range(depth):
+            name = f'group_{group_number}' if level == 0 else f'group_{group_number}_{level}'
+            survey_rows.append({'type': 'begin_group', 'name': name, 'label': f'Group {group_number}' + (f'.{level}' if level else '')})
+        for _ in range(group_size):
+            question_number += 1
+            row = {'name': f'q{question_number}', 'label': f'Question {question_number}', 'hint': f'Hint for question {question_number}'}
+            for language in language_names:
+                row[f'label::{language}'] = f'Question {question_number} ({language})'
+                row[f'hint::{language}'] = f'Hint for question {question_number} ({language})'
+            if question_number % 3 == 0:
+                row['type'] = f'select_one list_{question_number % choice_lists}'
+            else:
+                row['type'] = 'integer'
+                row['constraint'] = '. >= 0'
+            if question_number > 1:
+                row['relevant'] = ' and '.join(f"${{q{question_number - offset}}} != ''" for offset in range(1, min(references, question_number - 1) + 1))
+            if question_number % 2 == 0:
+                row['required'] = 'yes'
+            survey_rows.append(row)
+        survey_rows.extend({'type': 'end_group'} for _ in range(depth))
+        group_number += 1
+
+    translation_columns = [f'{column}::{language}' for language in language_names for column in ('label', 'hint')]
+    survey_df = pd.DataFrame(survey_rows[:rows], columns=['type', 'name', 'label', 'hint', 'relevant', 'constraint', 'required'] + translation_columns)
+    choices_df = pd.DataFrame(
+        [{'list_name': f'list_{list_number}', 'name': f'c{choice}', 'label': f'Choice {choice}',
+          **{f'label::{language}': f'Choice {choice} ({language})' for language in language_names}}
+         for list_number in range(choice_lists) for choice in range(choice_list_size)],
+        columns=['list_name', 'name', 'label'] + [f'label::{language}' for language in language_names]
+    )
+    return survey_df, choices_df
+
+# Function to write DataFrames as a minimal .xlsx workbook, one sheet each
+# openpyxl takes minutes on the largest scenarios, so the workbook is streamed by write_xlsx
+def write_workbook(path, sheets):
+    write_xlsx(path, {name: [list(df.columns)] + df.astype(object).where(df.notna(), None).values.tolist() for name, df in sheets.items()})
+
+# Function to write a synthetic XLSForm workbook for a scenario, returning its number of data rows
+def make_synthetic_workbook(path, scenario):
+    import pandas as pd
+
+    form_parameters = {key: value for key, value in scenario.items() if key != 'options'}
+    survey_df, choices_df = make_synthetic_form(**form_parameters)
+    settings_df = pd.DataFrame([{'form_title': 'Synthetic form', 'form_id': 'synthetic_form', 'version': '1'}])
+    write_workbook(path, {'survey': survey_df, 'choices': choices_df, 'settings': settings_df})
+    return len(survey_df) + len(choices_df)
+
+# Function to time a callable, returning the best of several runs in seconds
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+# Function to measure the memory a callable allocates: (peak MB, MB still held by its result)
+def traced_memory(function):
+    tracemalloc.start()
+    result = function()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 1024 ** 2, retained / 1024 ** 2
+
+# Function to read the peak resident set size of this process in MB
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Function to run every stage of one scenario in a fresh process, so its peak RSS is its own
+# Returns seconds, throughput, peak memory and memory held by the result per stage, and the peak RSS in MB
+def run_scenario(scenario, repeat, work_dir):
+    workbook_path = os.path.join(work_dir, 'form.xlsx')
+    workbook_rows = make_synthetic_workbook(workbook_path, scenario)
+    command = [sys.executable, os.path.abspath(__file__), '--measure', workbook_path, '--workbook-rows', str(workbook_rows),
+               '--options', json.dumps(scenario.get('options', {})), '--repeat', str(repeat)]
+    measured = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout)
+    return measured['stages'], measured['rss_mb']
+
+# Function to time and trace each stage on a workbook, in the process run_scenario starts
+def measure_stages(workbook_path, workbook_rows, options, repeat):
+    output_path = os.path.join(os.path.dirname(workbook_path), 'form.html')
+
+    # Each stage works from the previous stage's result, like a real run
+    sheets, _ = load_xlsform(workbook_path)
+    survey_df, choices_df, settings_df = sheets
+    questions = process_survey(survey_df, choices_df)
+    metadata = get_form_metadata(settings_df)
+    html_mb = len(''.join(iter_html(questions, metadata, options=options)).encode()) / 1024 ** 2
+
+    stages = {
+        'load': (lambda: load_xlsform(workbook_path), workbook_rows, 'rows'),
+        'parse': (lambda: process_survey(survey_df, choices_df), sheet_length(survey_df), 'rows'),
+        'render': (lambda: ''.join(iter_html(questions, metadata, options=options)), html_mb, 'MB'),
+        'write': (lambda: save_to_html(questions, metadata, output_path, options=options), html_mb, 'MB')
+    }
+
+    results = {}
+    for stage in STAGES:
+        function, amount, unit = stages[stage]
+        seconds = best_time(function, repeat)
+        # Tracing slows everything down, so memory is measured in a separate run
+        peak, held = traced_memory(function)
+        results[stage] = {'seconds': seconds, 'throughput': amount / seconds if seconds else 0.0, 'unit': f'{unit}/s', 'peak_mb': peak, 'held_mb': held}
+    return {'stages': results, 'rss_mb': peak_rss_mb()}
+
+# Function to time starting the CLI in a fresh interpreter, which is mostly the cost of its imports
+# Also measures the memory importing the module takes, and exits with an error if it pulls in pandas,
+# which alone takes longer than building a small form
+def run_startup(repeat):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xlsx_to_dictionary.py')
+    seconds = best_time(lambda: subprocess.run([sys.executable, script, '--help'], stdout=subprocess.DEVNULL, check=True), repeat)
+
+    import_check = ("import json, sys, tracemalloc; tracemalloc.start(); import xlsx_to_dictionary; "
+                    "print(json.dumps([tracemalloc.get_traced_memory()[1], 'pandas' in sys.modules]))")
+    output = subprocess.run([sys.executable, '-c', import_check], cwd=os.path.dirname(script), capture_output=True, text=True, check=True).stdout
+    peak, imports_pandas = json.loads(output)
+    if imports_pandas:
+        sys.exit("Importing xlsx_to_dictionary imports pandas, which every run would pay for")
+    return {'help': {'seconds': seconds, 'throughput': 1 / seconds, 'unit': 'runs/s', 'peak_mb': peak / 1024 ** 2, 'held_mb': 0.0}}
+
+# Function to compare results with a saved baseline, returning a line per stage that got slower or bigger
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            previous = baseline.get(name, {}).get(stage)
+            if not previous:
+                continue
+            for measure, label in (('seconds', 'time'), ('peak_mb', 'peak memory'), ('held_mb', 'held memory')):
+                # Baselines saved before held memory was measured have no held_mb
+                if (previous.get(measure) and result[measure] > previous[measure] * (1 + tolerance)
+                        and result[measure] - previous[measure] >= MIN_REGRESSION[measure]):
+                    regressions.append(f"{name} {stage}: {label} {result[measure]:.3f} vs baseline {previous[measure]:.3f} "
+                                       f"(+{(result[measure] / previous[measure] - 1) * 100:.0f}%)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each stage of building a dictionary (load, parse, render, write) on synthetic XLSForms.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help=f"Scenario to run; repeat to run several (default: {', '.join(DEFAULT_SCENARIOS)})")
+    parser.add_argument('--all', action='store_true', help='Run every scenario, including 100k rows and a million choices')
+    parser.add_argument('--rows', type=int, default=None, help='Run a single custom scenario with this many survey rows instead')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs per stage (the best is reported)')
+    parser.add_argument('--save-baseline', type=str, default=None, help='Save the results as a JSON baseline')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare the results with a saved baseline and exit 1 on a regression')
+    # Used by run_scenario to measure a scenario in its own process
+    parser.add_argument('--measure', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--workbook-rows', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--options', type=str, default='{}', help=argparse.SUPPRESS)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown or memory growth over the baseline, as a fraction (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure_stages(args.measure, args.workbook_rows, json.loads(args.options), args.repeat)))
+        return
+
+    if args.rows is not None:
+        scenarios = {f'rows-{args.rows}': {'rows': args.rows}}
+    else:
+        names = sorted(SCENARIOS) if args.all else (args.scenario or DEFAULT_SCENARIOS)
+        scenarios = {name: SCENARIOS[name] for name in names}
+
+    results = {'startup': run_startup(args.repeat)}
+    rss = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, scenario in scenarios.items():
+            results[name], rss[name] = run_scenario(scenario, args.repeat, work_dir)
+
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            print(f"{name:16} {stage:6} {result['seconds']:8.3f}s {result['throughput']:14,.1f} {result['unit']:6} "
+                  f"{result['peak_mb']:9.1f} MB peak {result['held_mb']:9.1f} MB held")
+        if rss.get(name) is not None:
+            print(f"{name:16} peak RSS {rss[name]:.1f} MB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,340 +1,2275 @@
-import pandas as pd
 import argparse
+import csv
+import contextlib
+import functools
+import glob
+import hashlib
+import html
+import itertools
+import json
+import marshal
+import operator
+import os
+import pickle
+import posixpath
 import re
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Sheets that make up an XLSForm as far as the dictionary is concerned
+XLSFORM_SHEETS = ('survey', 'choices', 'settings')
+
+# XML namespaces used inside the xlsx package
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+DOC_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Excel escapes control characters in strings as _xHHHH_
+EXCEL_ESCAPE_RE = re.compile(r'_x([0-9A-Fa-f]{4})_')
+CELL_REF_RE = re.compile(r'([A-Z]+)(\d+)')
+
+# ${name} references in XLSForm expressions
+REFERENCE_RE = re.compile(r'\$\{\s*([^}\s]+)\s*\}')
+
+# Survey columns whose expressions can refer to other fields with ${name}
+EXPRESSION_COLUMNS = ('relevant', 'constraint', 'calculation', 'choice_filter')
+
+# Number of consecutive empty rows after which a sheet is treated as finished
+# (real choices sheets do contain gaps of a few hundred rows between lists)
+MAX_EMPTY_ROWS = 1000
+
+# External choice files (select_one_from_file, search()) longer than this are summarised rather than listed
+EXTERNAL_CHOICES_LIMIT = 1000
+# Number of choices, and of distinct values per filter column, shown for a summarised file
+EXTERNAL_CHOICES_SAMPLE = 20
+# Distinct values counted per filter column before counting stops, to bound memory on huge files
+FILTER_VALUES_LIMIT = 10000
+# A choice_filter condition tying a choices column to an earlier answer: column = ${parent} (either way round)
+CHOICE_FILTER_RE = re.compile(r"([A-Za-z_][\w.-]*)\s*=\s*\$\{\s*([^}\s]+)\s*\}|\$\{\s*([^}\s]+)\s*\}\s*=\s*([A-Za-z_][\w.-]*)")
+SEARCH_APPEARANCE_RE = re.compile(r"search\(\s*['\"]([^'\"]+)['\"]")
+
+# Words indexed for the in-page search, and markup stripped from labels before indexing
+SEARCH_TOKEN_RE = re.compile(r'[^\W_]+')
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+# Sidebar search box and the script that queries the search index built by build_search_index()
+SEARCH_BOX_HTML = """<li><input type='search' id='search-box' placeholder='Search questions and choices' style='width: 100%; box-sizing: border-box; padding: 5px;'><ul id='search-results' style='padding-left: 0;'></ul></li>"""
+SEARCH_SCRIPT = """        <script>
+            (function() {
+                const index = window.SEARCH_INDEX;
+                const tokens = index.t.map(function(entry) { return entry[0]; });
+
+                // Question numbers for every indexed word starting with the prefix (tokens are sorted)
+                function lookup(prefix) {
+                    let low = 0, high = tokens.length;
+                    while (low < high) {
+                        const middle = (low + high) >> 1;
+                        if (tokens[middle] < prefix) { low = middle + 1; } else { high = middle; }
+                    }
+                    const matches = new Set();
+                    for (let i = low; i < tokens.length && tokens[i].startsWith(prefix); i++) {
+                        index.t[i][1].forEach(function(number) { matches.add(number); });
+                    }
+                    return matches;
+                }
+
+                const box = document.getElementById('search-box');
+                const results = document.getElementById('search-results');
+                box.addEventListener('input', function() {
+                    const words = box.value.toLowerCase().match(/[\\p{L}\\p{N}]+/gu) || [];
+                    let matches = null;
+                    words.forEach(function(word) {
+                        const found = lookup(word);
+                        matches = matches === null ? found : new Set([...matches].filter(function(number) { return found.has(number); }));
+                    });
+                    results.innerHTML = '';
+                    [...(matches || [])].sort(function(a, b) { return a - b; }).slice(0, 50).forEach(function(number) {
+                        const item = document.createElement('li');
+                        const link = document.createElement('a');
+                        link.href = index.q[number][0];
+                        link.textContent = index.q[number][1];
+                        item.appendChild(link);
+                        results.appendChild(item);
+                    });
+                });
+            })();
+        </script>
+"""
+
+# Script for a page with several language versions (see iter_html): shows the version picked in the switcher
+LANGUAGE_SWITCHER_SCRIPT = """        <script>
+            (function() {
+                const select = document.getElementById('language-select');
+                select.addEventListener('change', function() {
+                    const language = this.value;
+                    document.querySelectorAll('[data-language]').forEach(function(element) {
+                        element.style.display = element.getAttribute('data-language') === language ? '' : 'none';
+                    });
+                });
+
+                // Group ids repeat across the versions, so sidebar links jump within the version shown
+                document.querySelectorAll('.sidebar li[data-language] a').forEach(function(link) {
+                    link.addEventListener('click', function(event) {
+                        const version = document.querySelector("div[data-language='" + select.value + "']");
+                        const target = version.querySelector("[id='" + CSS.escape(this.getAttribute('href').slice(1)) + "']");
+                        if (target) {
+                            event.preventDefault();
+                            target.scrollIntoView();
+                        }
+                    });
+                });
+            })();
+        </script>
+"""
+
+# Bump whenever the generated HTML changes so cached dictionaries are not reused
+RENDERER_VERSION = '1.09'
+
+# Number of distinct expressions remembered, split around their ${} references, between forms
+EXPRESSION_CACHE_SIZE = 4096
+
+# Expressions humanised again within a form, which process_survey answers from its own memo
+EXPRESSION_CACHE_STATS = {'Repeats': 0}
+
+# Options for building a dictionary; the CLI fills these from its arguments
+DEFAULT_OPTIONS = {
+    'use_pandas': False,
+    'max_empty_rows': MAX_EMPTY_ROWS,
+    'cache_dir': None,
+    'cache_size_mb': 200,
+    'refresh_cache': False,
+    'lazy_choices': False,
+    'shard': False,
+    'search': False,
+    'save_model': None,
+    'languages': None,
+    'dependency_json': None,
+    'exports': (),
+    'render_workers': False
+}
+
+# Forms with fewer questions than this are rendered serially even when render_workers is set
+PARALLEL_RENDER_MIN_QUESTIONS = 10000
+
+# Options that change the generated output and therefore belong in the cache key
+OUTPUT_OPTIONS = ('lazy_choices', 'shard', 'search', 'languages')
+
+# Hooks that instrument the pipeline stages; see pipeline_stage and make_profile_hook
+STAGE_HOOKS = []
+
+# Function to mark a library function as a pipeline stage (load, parse, render, ...)
+# Each hook in STAGE_HOOKS is called with the stage name and returns a context manager wrapped around the call
+def pipeline_stage(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not STAGE_HOOKS:
+                return function(*args, **kwargs)
+            with contextlib.ExitStack() as stack:
+                for hook in list(STAGE_HOOKS):
+                    stack.enter_context(hook(name))
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# Function to make a stage hook that appends each stage's wall time and peak traced memory to report['Stages']
+# Stages named in cprofile_stages are also run under cProfile and saved as <stage>.prof in cprofile_dir
+def make_profile_hook(report, cprofile_dir=None, cprofile_stages=('parse', 'render')):
+    import cProfile
+    import tracemalloc
+
+    @contextlib.contextmanager
+    def hook(stage):
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler = None
+        if cprofile_dir and stage in cprofile_stages:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+                os.makedirs(cprofile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(cprofile_dir, f'{stage}.prof'))
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            report['Stages'].append({'Stage': stage, 'Seconds': seconds, 'Peak_MB': peak / 1024 ** 2})
+
+    return hook
+
+# Function to resolve the worksheet and shared string parts from the workbook
+def find_workbook_parts(archive):
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+
+    targets = {}
+    shared_strings_path = None
+    for rel in rels.iter(f'{PACKAGE_REL_NS}Relationship'):
+        target = rel.get('Target')
+        # Targets are relative to xl/ unless they are absolute package paths
+        if target.startswith('/'):
+            target = target.lstrip('/')
+        else:
+            target = posixpath.normpath(posixpath.join('xl', target))
+        targets[rel.get('Id')] = target
+        if rel.get('Type', '').endswith('/sharedStrings'):
+            shared_strings_path = target
+
+    sheet_paths = {}
+    for sheet in workbook.iter(f'{SHEET_NS}sheet'):
+        target = targets.get(sheet.get(f'{DOC_REL_NS}id'))
+        if target:
+            sheet_paths[sheet.get('name')] = target
+
+    return sheet_paths, shared_strings_path
+
+# Function to join the text runs of a shared or inline string, skipping phonetic runs
+def string_item_text(item):
+    parts = []
+    for child in item:
+        if child.tag == f'{SHEET_NS}t':
+            parts.append(child.text or '')
+        elif child.tag == f'{SHEET_NS}r':
+            text = child.find(f'{SHEET_NS}t')
+            if text is not None:
+                parts.append(text.text or '')
+    text = ''.join(parts)
+    if '_x' in text:
+        text = EXCEL_ESCAPE_RE.sub(lambda match: chr(int(match.group(1), 16)), text)
+    return text
+
+# Function to stream the shared string table
+def read_shared_strings(archive, path):
+    shared_strings = []
+    if path is None or path not in archive.namelist():
+        return shared_strings
+
+    with archive.open(path) as file:
+        for _, elem in ET.iterparse(file, events=('end',)):
+            if elem.tag == f'{SHEET_NS}si':
+                shared_strings.append(string_item_text(elem))
+                elem.clear()
+
+    return shared_strings
+
+# Function to convert a column reference such as "BI" to a zero-based index
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+# Function to convert a single <c> element to a Python value
+def cell_value(cell, shared_strings):
+    cell_type = cell.get('t', 'n')
+
+    if cell_type == 'inlineStr':
+        inline = cell.find(f'{SHEET_NS}is')
+        return string_item_text(inline) if inline is not None else None
+
+    value = cell.find(f'{SHEET_NS}v')
+    if value is None or value.text is None:
+        return None
+    text = value.text
+
+    if cell_type == 's':
+        return shared_strings[int(text)] or None  # Empty strings are blank cells to pandas
+    if cell_type == 'b':
+        return text == '1'
+    if cell_type in ('str', 'e', 'd'):
+        return text
+
+    # Plain numbers keep the int/float distinction openpyxl makes
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+# Function to stream the rows of one worksheet as lists of cell values
+def read_sheet_rows(archive, path, shared_strings, max_empty_rows=MAX_EMPTY_ROWS):
+    rows = []
+    last_row = 0
+    dimension_last_row = 0
+
+    with archive.open(path) as file:
+        for _, elem in ET.iterparse(file, events=('end',)):
+            if elem.tag == f'{SHEET_NS}row':
+                row_number = int(elem.get('r', last_row + 1))
+                last_row = row_number
+
+                values = []
+                for cell in elem.iter(f'{SHEET_NS}c'):
+                    ref = cell.get('r')
+                    if ref:
+                        index = column_index(CELL_REF_RE.match(ref).group(1))
+                        values.extend([None] * (index - len(values)))
+                    values.append(cell_value(cell, shared_strings))
+                elem.clear()
+
+                if any(value is not None for value in values):
+                    # Blank rows between data rows are still rows for pandas
+                    rows.extend([] for _ in range(row_number - 1 - len(rows)))
+                    rows.append(values)
+                elif row_number - len(rows) > max_empty_rows:
+                    # A long run of formatted-but-empty rows means the data has ended
+                    break
+
+            elif elem.tag == f'{SHEET_NS}dimension':
+                # The declared extent (e.g. A1:BI891) includes pre-formatted blank rows
+                match = CELL_REF_RE.match(elem.get('ref', '').split(':')[-1])
+                if match:
+                    dimension_last_row = int(match.group(2))
+
+            elif elem.tag == f'{SHEET_NS}sheetData':
+                # Everything after the cell data is formatting, validation and drawings
+                break
+
+    skipped_rows = max(last_row, dimension_last_row) - len(rows)
+    return rows, skipped_rows
+
+# Function to turn raw rows into columns shaped like pd.read_excel(sheet_name=...)
+def rows_to_columns(rows):
+    # Trailing empty cells are trimmed, as the openpyxl reader in pandas does
+    rows = [row[:max((i + 1 for i, value in enumerate(row) if value is not None), default=0)] for row in rows]
+    if not rows:
+        return {}
+
+    header = rows[0]
+    width = max(len(row) for row in rows)
+    columns = {}
+    for index in range(width):
+        column_name = header[index] if index < len(header) and header[index] is not None else f'Unnamed: {index}'
+
+        # Duplicate headers get the same .1, .2 suffixes pandas gives them
+        unique_name = column_name
+        duplicate = 0
+        while unique_name in columns:
+            duplicate += 1
+            unique_name = f'{column_name}.{duplicate}'
+
+        columns[unique_name] = [row[index] if index < len(row) else None for row in rows[1:]]
+
+    return columns
+
+# Function to read only the XLSForm sheets without loading the rest of the workbook
+def read_xlsform_sheets(file_path, sheet_names=XLSFORM_SHEETS, max_empty_rows=MAX_EMPTY_ROWS):
+    sheets = {}
+    skipped_rows = {}
+
+    with zipfile.ZipFile(file_path) as archive:
+        sheet_paths, shared_strings_path = find_workbook_parts(archive)
+        shared_strings = read_shared_strings(archive, shared_strings_path)
+
+        for sheet_name in sheet_names:
+            if sheet_name not in sheet_paths:
+                raise ValueError(f"Worksheet named '{sheet_name}' not found")
+            rows, skipped_rows[sheet_name] = read_sheet_rows(archive, sheet_paths[sheet_name], shared_strings, max_empty_rows)
+            sheets[sheet_name] = rows_to_columns(rows)
+
+    return sheets, skipped_rows
+
+# Function to load the survey, choices and settings sheets
+# The streaming reader gives each sheet as a dict of column lists; with use_pandas they are DataFrames
+# (pandas is only imported then, as importing it takes longer than reading most forms)
+# Also returns how many empty trailing rows were skipped per sheet (empty when pandas does the reading)
+@pipeline_stage('load')
+def load_xlsform(file_path, use_pandas=False, max_empty_rows=MAX_EMPTY_ROWS):
+    if use_pandas:
+        import pandas as pd
+        xls = pd.ExcelFile(file_path)
+        return tuple(pd.read_excel(xls, sheet_name=sheet_name) for sheet_name in XLSFORM_SHEETS), {}
+
+    sheets, skipped_rows = read_xlsform_sheets(file_path, max_empty_rows=max_empty_rows)
+    return tuple(sheets[sheet_name] for sheet_name in XLSFORM_SHEETS), skipped_rows
+
+# Function to split an expression around its ${name} references: text, name, text, ..., text
+# Memoised on the expression, so forms (and languages) in the same process never scan the same expression twice
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def split_expression(expression):
+    return tuple(REFERENCE_RE.split(expression))
+
+# Function to replace each ${name} reference with the referenced question's label
+# Only the ${} tokens are rewritten, so names are never substituted inside a label already put in
+def humanise_expression(expression, name_to_label):
+    parts = split_expression(expression)
+    if len(parts) == 1:
+        return expression
+    parts = list(parts)
+    parts[1::2] = [name_to_label.get(name, name) for name in parts[1::2]]
+    return ''.join(parts)
+
+# Function to report how often expressions were reused: Repeats within a form, then Hits and Misses
+# of the memo of split expressions shared between forms, for each expression's first use in a form
+def expression_cache_info():
+    info = split_expression.cache_info()
+    return {'Repeats': EXPRESSION_CACHE_STATS['Repeats'], 'Hits': info.hits, 'Misses': info.misses, 'Size': info.currsize, 'Max_Size': info.maxsize}
+
+# Function to check for a blank cell, which is None from the streaming reader and NaN from pandas
+def is_blank(value):
+    return value is None or value != value
+
+# Function to count the rows of a sheet given as a DataFrame or a dict of columns
+def sheet_length(sheet):
+    if isinstance(sheet, dict):
+        return len(next(iter(sheet.values()), []))
+    return len(sheet)
+
+# Function to pull one column out as a list of values, as a DataFrame would hold them
+# A column of numbers with blanks becomes floats with NaN blanks, so both readers give the same values
+def column_values(sheet, column):
+    if not isinstance(sheet, dict):
+        return sheet[column].tolist()
+
+    values = sheet[column]
+    numbers = [value for value in values if value is not None]
+    if numbers and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in numbers):
+        if len(numbers) < len(values) or any(isinstance(value, float) for value in numbers):
+            return [float('nan') if value is None else float(value) for value in values]
+    return values
+
+# Function to pull one column out as plain strings, with blank cells as None
+def column_strings(sheet, column):
+    if column not in sheet:
+        return [None] * sheet_length(sheet)
+    if isinstance(sheet, dict):
+        return [None if is_blank(value) else str(value) for value in column_values(sheet, column)]
+    values = sheet[column]
+    return values.astype(str).astype(object).where(values.notna(), None).tolist()
+
+# Class for the parsed question and choice records
+# Fields live in __slots__ rather than a per-record dict, and are read as record['Field'] like a dict
+# Each subclass sets field_getter to operator.attrgetter(*__slots__), which reads every field at once in C
+class Record:
+    __slots__ = ()
+    field_getter = None
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def keys(self):
+        return self.__slots__
+
+    def values(self):
+        return self.field_getter(self)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(self[field] == other[field] for field in self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{field}={self[field]!r}' for field in self.__slots__)})"
+
+# Class for one question; Choices is the label list shared by every question using the same list,
+# Choices_Note describes choices from an external file, Cascade is the parent -> child tree of a cascading select
+# (see build_cascade), Used_By lists the fields whose expressions refer to this question and Anchor is the
+# question's own id on the page, unique even where a name is used more than once
+class Question(Record):
+    __slots__ = ('Heading', 'Label', 'Name', 'Path', 'Type', 'Hint', 'Relevant', 'Relevant_Expression',
+                 'Constraint', 'Required', 'Choices', 'List_Name', 'Group_Level', 'Group', 'Top_Group', 'Used_By', 'Choices_Note', 'Cascade', 'Anchor')
+    field_getter = operator.attrgetter(*__slots__)
+
+    def __init__(self, Heading=None, Label=None, Name=None, Path=None, Type=None, Hint=None, Relevant=None, Relevant_Expression=None,
+                 Constraint=None, Required=None, Choices=None, List_Name=None, Group_Level=None, Group=None, Top_Group=None, Used_By=None, Choices_Note=None, Cascade=None, Anchor=None):
+        self.Heading = Heading
+        self.Label = Label
+        self.Name = Name
+        self.Path = Path
+        self.Type = Type
+        self.Hint = Hint
+        self.Relevant = Relevant
+        self.Relevant_Expression = Relevant_Expression
+        self.Constraint = Constraint
+        self.Required = Required
+        self.Choices = Choices
+        self.List_Name = List_Name
+        self.Group_Level = Group_Level
+        self.Group = Group
+        self.Top_Group = Top_Group
+        self.Used_By = Used_By
+        self.Choices_Note = Choices_Note
+        self.Cascade = Cascade
+        self.Anchor = Anchor
+
+# Positions of the Question fields that hold values shared between questions (see group_fingerprint)
+CHOICES_FIELD = Question.__slots__.index('Choices')
+CASCADE_FIELD = Question.__slots__.index('Cascade')
+
+# Class for one choice; Extra holds any other non-blank columns of its row
+class Choice(Record):
+    __slots__ = ('Name', 'Label', 'Extra')
+    field_getter = operator.attrgetter(*__slots__)
+
+    def __init__(self, Name=None, Label=None, Extra=None):
+        self.Name = Name
+        self.Label = Label
+        self.Extra = Extra
+
+# Function to group the choices sheet once into ordered choice lists keyed by list_name
+def build_choice_index(choices_df):
+    choice_index = {}
+    if 'list_name' not in choices_df:
+        return choice_index
+
+    # Any column other than list_name/name/label (filters, media, translations) is kept per choice
+    extra_columns = [column for column in choices_df if column not in ('list_name', 'name', 'label')]
+    # Blank names and labels are None from either reader (pandas reads them as NaN)
+    names = [None if is_blank(value) else value for value in column_values(choices_df, 'name')] if 'name' in choices_df else [None] * sheet_length(choices_df)
+    labels = [None if is_blank(value) else value for value in column_values(choices_df, 'label')] if 'label' in choices_df else [None] * sheet_length(choices_df)
+    extras = [column_values(choices_df, column) for column in extra_columns]
+
+    for position, list_name in enumerate(column_values(choices_df, 'list_name')):
+        if is_blank(list_name):
+            continue
+        choice_index.setdefault(list_name, []).append(Choice(
+            Name=names[position],
+            Label=labels[position],
+            Extra={column: values[position] for column, values in zip(extra_columns, extras) if not is_blank(values[position])}
+        ))
+
+    return choice_index
+
+# Function to replace each ${name} reference with a link to the referenced question
+# links maps a name to (href, label); names without a question (such as groups) are left as the name
+def link_expression(expression, links):
+    def replace(match):
+        name = match.group(1)
+        if name not in links:
+            return name
+        href, label = links[name]
+        return f"<a href='{href}'>{label}</a>"
+    return REFERENCE_RE.sub(replace, expression)
+
+# Function to find the external file a question takes its choices from, if any
+# select_one_from_file/select_multiple_from_file name the file; a search('name') appearance reads name.csv
+def external_choice_file(row_type, appearance):
+    if '_from_file' in row_type:
+        parts = row_type.split()
+        return parts[1] if len(parts) > 1 else None
+    if appearance and 'search' in appearance:
+        match = SEARCH_APPEARANCE_RE.search(appearance)
+        if match:
+            return f"{match.group(1)}.csv"
+    return None
+
+# Function to list the external choice files a survey uses, in survey order
+def external_choice_files(survey_df):
+    files = []
+    types = column_strings(survey_df, 'type')
+    for row_type, appearance in zip(types, column_strings(survey_df, 'appearance')):
+        file_name = external_choice_file(row_type or '', appearance)
+        if file_name and file_name not in files:
+            files.append(file_name)
+    return files
+
+# Function to stream an external CSV or XML choice file as its column names followed by one list of values per row
+def iter_external_rows(path):
+    if path.lower().endswith('.xml'):
+        # Items are <item><name>...</name><label>...</label></item>, as ODK expects; the first item sets the columns
+        columns = None
+        for _, elem in ET.iterparse(path, events=('end',)):
+            if elem.tag == 'item':
+                values = {child.tag: (child.text or '').strip() for child in elem}
+                if columns is None:
+                    columns = list(values)
+                    yield columns
+                yield [values.get(column, '') for column in columns]
+                elem.clear()
+        return
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        yield from csv.reader(file)
+
+# Function to read an external choice file in one streaming pass, keeping only what the dictionary shows
+# Returns a dict with the File name, the choice Count, the Labels (all of them up to EXTERNAL_CHOICES_LIMIT,
+# otherwise the first EXTERNAL_CHOICES_SAMPLE), whether they are Complete, and for every other column
+# (the ones a choice_filter can use) its distinct Values; Error is set if the file could not be read
+def read_external_choices(path):
+    summary = {'File': os.path.basename(path), 'Count': 0, 'Labels': [], 'Complete': True, 'Filters': {}, 'Error': None}
+    filter_values = {}
+    try:
+        rows = iter_external_rows(path)
+        columns = next(rows, [])
+
+        # Untranslated labels where there are any, otherwise the first translation, otherwise the names
+        label_columns = [column for column in columns if column.startswith('label')]
+        label_column = 'label' if 'label' in columns else (label_columns[0] if label_columns else 'name')
+        label_index = columns.index(label_column) if label_column in columns else None
+        name_index = columns.index('name') if 'name' in columns else None
+        filter_indexes = [(columns.index(column), filter_values.setdefault(column, {}))
+                          for column in columns if column and column != 'name' and not column.startswith('label')]
+
+        count = 0
+        labels = summary['Labels']
+        for row in rows:
+            count += 1
+            if count <= EXTERNAL_CHOICES_LIMIT:
+                label = row[label_index] if label_index is not None and label_index < len(row) else None
+                if not label and name_index is not None and name_index < len(row):
+                    label = row[name_index]
+                labels.append(label)
+            for index, values in filter_indexes:
+                if index < len(row) and row[index] and len(values) < FILTER_VALUES_LIMIT:
+                    values[row[index]] = None
+        summary['Count'] = count
+    except FileNotFoundError:
+        summary['Error'] = 'not found'
+        return summary
+    except (OSError, ET.ParseError, csv.Error, UnicodeDecodeError) as exc:
+        summary['Error'] = f"{type(exc).__name__}: {exc}"
+        return summary
+
+    if summary['Count'] > EXTERNAL_CHOICES_LIMIT:
+        summary['Labels'] = summary['Labels'][:EXTERNAL_CHOICES_SAMPLE]
+        summary['Complete'] = False
+    summary['Filters'] = {column: list(values) for column, values in filter_values.items()}
+    return summary
+
+# Function to describe an external choice file for the dictionary, as shown above its choices
+def external_choices_note(summary):
+    if summary['Error']:
+        return f"Choices from {summary['File']}, which could not be read ({summary['Error']})"
+    note = f"{summary['Count']:,} choices from {summary['File']}"
+    if not summary['Complete']:
+        note += f"; showing the first {len(summary['Labels'])}"
+    filters = []
+    for column, values in summary['Filters'].items():
+        count = f"{len(values):,}+" if len(values) >= FILTER_VALUES_LIMIT else f"{len(values):,}"
+        shown = ', '.join(values[:EXTERNAL_CHOICES_SAMPLE]) + (', ...' if len(values) > EXTERNAL_CHOICES_SAMPLE else '')
+        filters.append(f"{column} ({count} values: {shown})")
+    if filters:
+        note += f". Filter columns: {'; '.join(filters)}"
+    return html.escape(note, quote=False)
+
+# Function to find the choices column and parent question a choice_filter cascades on, as (column, parent)
+# Only the first column = ${parent} condition is used; other filters return None
+def parse_choice_filter(expression):
+    match = CHOICE_FILTER_RE.search(expression or '')
+    if not match:
+        return None
+    if match.group(1):
+        return match.group(1), match.group(2)
+    return match.group(4), match.group(3)
+
+# Function to turn a choice name or filter value into the string a choice_filter compares
+# Numeric columns with blanks are read as floats, on either side: a filter column holding 2.0 must match
+# a parent choice named 2, and a parent name read as 2.0 must match a filter value of 2
+def filter_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+# Function to index a choice list by the values of one of its columns: value -> positions of the choices with it
+# Choices with the column blank are indexed under None
+def build_filter_index(choices, column):
+    index = {}
+    for position, choice in enumerate(choices):
+        value = choice['Extra'].get(column)
+        index.setdefault(None if value is None else filter_value(value), []).append(position)
+    return index
+
+# Function to build the parent -> child tree of a cascading select from a filter index
+# Returns a dict with the filter Column, the Parent question name and its Parent_Label, and Branches:
+# [value, label of the parent's choice with that value (or the value), child labels] per value in choice order
+def build_cascade(choices, filter_index, column, parent, parent_label, parent_choices, language=None):
+    value_labels = {filter_value(choice['Name']): choice_label(choice, language) for choice in parent_choices}
+    branches = []
+    for value, positions in filter_index.items():
+        label = value_labels.get(value, value) if value is not None else '(no value)'
+        branches.append([value, label, [choice_label(choices[position], language) for position in positions]])
+    return {'Column': column, 'Parent': parent, 'Parent_Label': parent_label, 'Branches': branches}
+
+# Function to find the languages of a form from its label::<language> and hint::<language> columns, in sheet order
+def form_languages(survey_df, choices_df):
+    languages = []
+    for column in list(survey_df) + list(choices_df):
+        prefix, separator, language = str(column).partition('::')
+        if separator and prefix in ('label', 'hint') and language not in languages:
+            languages.append(language)
+    return languages
+
+# Function to pull one column out as plain strings in a language, falling back to the untranslated column
+def translated_strings(sheet, column, language=None):
+    values = column_strings(sheet, column)
+    if language is None:
+        return values
+    return [translation if translation is not None else value for translation, value in zip(column_strings(sheet, f'{column}::{language}'), values)]
+
+# Function to get a choice's label in a language, falling back to the untranslated label
+def choice_label(choice, language=None):
+    if language is None:
+        return choice['Label']
+    return choice['Extra'].get(f'label::{language}', choice['Label'])
+
+# Function to build the graph of ${name} references between fields in one scan of the expression columns
+# Returns a dict with:
+#   Depends_On - for each field, the names each of its expression columns refers to
+#   Used_By    - for each referenced name, the fields whose expressions refer to it, in survey order
+def build_dependency_graph(survey_df):
+    depends_on = {}
+    used_by = {}
+    linked = set()  # (reference, name) pairs already in used_by
+    columns = [column for column in EXPRESSION_COLUMNS if column in survey_df]
+    for name, *expressions in zip(column_strings(survey_df, 'name'), *(column_strings(survey_df, column) for column in columns)):
+        if name is None:
+            continue
+        for column, expression in zip(columns, expressions):
+            if not expression or '${' not in expression:
+                continue
+            referenced = list(dict.fromkeys(REFERENCE_RE.findall(expression)))
+            if not referenced:
+                continue
+            # A name used on more than one row (e.g. in different repeats) keeps the references of every row
+            column_references = depends_on.setdefault(name, {}).setdefault(column, [])
+            column_references.extend(reference for reference in referenced if reference not in column_references)
+            for reference in referenced:
+                if reference == name:
+                    continue  # A field checking its own value does not make it "used by" itself
+                # A field is listed once even when several of its expressions (or rows) use the name
+                if (reference, name) not in linked:
+                    linked.add((reference, name))
+                    used_by.setdefault(reference, []).append(name)
+    return {'Depends_On': depends_on, 'Used_By': used_by}
 
 # Function to process grouping and path
-def process_survey(survey_df, choices_df):
+# Pass a list as group_tree to also collect the group/repeat tree (see build_form_model)
+# and a dict as dependencies to also collect the dependency graph (see build_dependency_graph)
+# With a language the label::<language> and hint::<language> columns are used where filled in
+# external_choices maps external choice file names to read_external_choices() summaries
+def process_survey(survey_df, choices_df, group_tree=None, language=None, dependencies=None, external_choices=None):
     group_stack = []
+    node_stack = []
     path = ""
     questions = []
 
+    # Index the choices sheet once; every question using a list shares the same label list
+    choice_index = build_choice_index(choices_df)
+    choice_labels = {list_name: [choice_label(choice, language) for choice in choices] for list_name, choices in choice_index.items()}
+
+    # Pull the survey columns out once so the row loop only touches plain Python values
+    # Type strings repeat on most rows, so each distinct one is kept once
+    # Blank types are '' from either reader, as form_cache_key sees them
+    types = ['' if value is None else sys.intern(value) for value in column_strings(survey_df, 'type')]
+    labels = translated_strings(survey_df, 'label', language)
+    names = column_strings(survey_df, 'name')
+    hints = translated_strings(survey_df, 'hint', language)
+    relevants = column_strings(survey_df, 'relevant')
+    constraints = column_strings(survey_df, 'constraint')
+    requireds = column_strings(survey_df, 'required')
+    appearances = column_strings(survey_df, 'appearance')
+    choice_filters = column_strings(survey_df, 'choice_filter')
+
+    # Cascading selects index their list by the filter column once, however many questions share it
+    select_lists = {}
+    filter_indexes = {}
+    cascades = {}
+
+    # Find which fields read each question
+    graph = build_dependency_graph(survey_df)
+    if dependencies is not None:
+        dependencies.update(graph)
+    used_by = graph['Used_By']
+
     # Create a mapping of variable names to labels
-    name_to_label = {
-    str(row['name']): str(row['label']) for _, row in survey_df.iterrows() if pd.notna(row['name']) and pd.notna(row['label'])
-    }
+    name_to_label = {name: label for name, label in zip(names, labels) if name is not None and label is not None}
+    # The mapping is fixed for the form, so each distinct expression is humanised once
+    humanised = {}
+    # Anchors already given out; a repeated name gets q-<name>:2, q-<name>:3, ... (':' cannot occur in a name)
+    anchors = set()
 
     # Iterate over each row in the survey sheet
-    for _, row in survey_df.iterrows():
-        row_type = str(row.get('type', ''))  # Convert to string to handle NaN
-        label = str(row['label']) if pd.notna(row.get('label')) else None
-        name = str(row['name']) if pd.notna(row.get('name')) else None
-        hint = str(row['hint']) if pd.notna(row.get('hint')) else None
-        relevant = str(row['relevant']) if pd.notna(row.get('relevant')) else None
-        constraint = str(row['constraint']) if pd.notna(row.get('constraint')) else None
-        required = str(row['required']) if pd.notna(row.get('required')) else None
+    for row_type, label, name, hint, relevant, constraint, required, appearance, choice_filter in zip(types, labels, names, hints, relevants, constraints, requireds, appearances, choice_filters):
+        # Handle group/repeat beginnings
+        if 'begin_group' in row_type or 'begin_repeat' in row_type:
+            group_stack.append(label if label else name)  # Use label if available
+            if group_tree is not None:
+                node = {
+                    'Name': name,
+                    'Label': label,
+                    'Kind': 'repeat' if 'begin_repeat' in row_type else 'group',
+                    'Relevant': relevant,
+                    'Groups': [],
+                    'Questions': []
+                }
+                (node_stack[-1]['Groups'] if node_stack else group_tree).append(node)
+                node_stack.append(node)
+            continue
 
+        # Handle group/repeat endings
+        elif 'end_group' in row_type or 'end_repeat' in row_type:
+            if group_stack:
+                group_stack.pop()  # Pop from stack to reduce indentation
+            if node_stack:
+                node_stack.pop()
+            continue
 
-        # Handle group beginnings with visual bars and indentation
-        if 'begin_group' in row_type or 'begin_repeat' in row_type:
-            group_stack.append(label if label else name)  # Push group/repeat onto the stack
+        # Skip if both label and name are NaN
+        if not label and not name:
+            continue
+
+        # Create the main heading: label (name)
+        heading = label if label else ""
+        if name:
+            heading += f" [{name}]" if label else name
+
+        # Replace ${name} references in 'relevant' with their corresponding labels
+        relevant_expression = relevant
+        if relevant:
+            if relevant in humanised:
+                EXPRESSION_CACHE_STATS['Repeats'] += 1
+            else:
+                humanised[relevant] = humanise_expression(relevant, name_to_label)
+            relevant = humanised[relevant]
+
+        anchor = f"q-{name or 'question'}"
+        occurrence = 1
+        while anchor in anchors:
+            occurrence += 1
+            anchor = f"q-{name or 'question'}:{occurrence}"
+        anchors.add(anchor)
+
+        # Build question structure
+        question_data = Question(
+            Heading=heading,
+            Label=label,
+            Name=name,
+            Path=path,
+            Type=row_type,
+            Hint=hint,
+            Relevant=relevant,
+            Relevant_Expression=relevant_expression,
+            Constraint=constraint,
+            Required=required,
+            Group_Level=len(group_stack),
+            Group=group_stack[-1] if group_stack else None,
+            Top_Group=group_stack[0] if group_stack else None,
+            Used_By=used_by.get(name),
+            Anchor=anchor
+        )
+
+        # Handle select_one or select_multiple with choices
+        if 'select_one' in row_type or 'select_multiple' in row_type:
+            list_name = row_type.split()[1] if len(row_type.split()) > 1 else None
+            question_data.Choices = choice_labels.get(list_name, [])
+            question_data.List_Name = list_name
+            select_lists[name] = list_name
+
+            # A choice_filter on an earlier answer splits the list into one branch per value of the filter column
+            cascade_filter = parse_choice_filter(choice_filter) if choice_filter else None
+            if cascade_filter and list_name in choice_index:
+                column, parent = cascade_filter
+                key = (list_name, column, parent)
+                if key not in cascades:
+                    if (list_name, column) not in filter_indexes:
+                        filter_indexes[(list_name, column)] = build_filter_index(choice_index[list_name], column)
+                    parent_choices = choice_index.get(select_lists.get(parent), [])
+                    cascades[key] = build_cascade(choice_index[list_name], filter_indexes[(list_name, column)], column,
+                                                  parent, name_to_label.get(parent, parent), parent_choices, language)
+                question_data.Cascade = cascades[key]
+
+            # Choices from an external file replace the (placeholder) choices sheet list
+            choice_file = external_choice_file(row_type, appearance) if external_choices else None
+            if choice_file is not None and choice_file in external_choices:
+                question_data.Choices = external_choices[choice_file]['Labels']
+                question_data.List_Name = choice_file
+                question_data.Choices_Note = external_choices_note(external_choices[choice_file])
+
+        if node_stack:
+            node_stack[-1]['Questions'].append(len(questions))
+        questions.append(question_data)
+    
+    return questions
+
+# Function to generate HTML for each question as a sequence of chunks
+# With lazy_choices the choices are left out and built in the browser from the embedded choice lists
+# With links (question name -> href) the box gets its anchor and relevance references become links
+def iter_question_html(question, lazy_choices=False, links=None):
+    if links is None:
+        yield f"<div class='question-box'><h4 class='question-label'>{question['Heading']}</h4>"
+    else:
+        yield f"<div class='question-box' id='{question['Anchor']}'><h4 class='question-label'>{question['Heading']}</h4>"
+
+    # Add additional elements with color coding
+    if question['Hint']:
+        yield f"<p class='hint'><strong>Hint:</strong> {question['Hint']}</p>"
+    if question['Relevant'] and links is not None:
+        yield f"<p class='relevant'><strong>Relevant:</strong> {link_expression(question['Relevant_Expression'], links)}</p>"
+    elif question['Relevant']:
+        yield f"<p class='relevant'><strong>Relevant:</strong> {question['Relevant']}</p>"
+    if question['Constraint']:
+        yield f"<p class='constraint'><strong>Constraint:</strong> {question['Constraint']}</p>"
+    if question['Required']:
+        yield f"<p class='required'><strong>Required:</strong> {question['Required']}</p>"
+    if question['Used_By'] and links is not None:
+        used_by = ', '.join(f"<a href='{links[name][0]}'>{links[name][1]}</a>" if name in links else name for name in question['Used_By'])
+        yield f"<p class='used-by'><strong>Used by:</strong> {used_by}</p>"
+    elif question['Used_By']:
+        yield f"<p class='used-by'><strong>Used by:</strong> {', '.join(question['Used_By'])}</p>"
+
+    # Add question type
+    yield f"<p class='type'><em>Type:</em> {question['Type']}</p>"
+
+    # Add collapsible choices if applicable
+    if question['Choices_Note']:
+        yield f"<p class='choices-note'><em>{question['Choices_Note']}</em></p>"
+    if question['Choices'] and lazy_choices:
+        yield f"<div class='choices-container'><button class='choices-btn' data-list='{html.escape(str(question['List_Name']), quote=True)}'>Show Choices</button><div class='choices' style='display: none;'></div></div>"
+    elif question['Choices'] and question['Cascade']:
+        # Cascading selects show one expandable branch per value of the answer they are filtered on
+        cascade = question['Cascade']
+        yield "<div class='choices-container'><button class='choices-btn'>Show Choices</button><div class='choices' style='display: none;'>"
+        yield f"<p class='cascade'><em>By {cascade['Parent_Label']} ({cascade['Column']}):</em></p><ul>"
+        for _, label, children in cascade['Branches']:
+            yield f"<li><details><summary>{label} ({len(children)})</summary><ul>"
+            for child in children:
+                yield f"<li>{child}</li>"
+            yield "</ul></details></li>"
+        yield "</ul></div></div>"
+    elif question['Choices']:
+        yield "<div class='choices-container'><button class='choices-btn'>Show Choices</button><ul class='choices' style='display: none;'>"
+        for choice in question['Choices']:
+            yield f"<li>{choice}</li>"
+        yield "</ul></div>"
+
+    yield "</div>"
+
+# Function to generate HTML for each question
+def generate_question_html(question):
+    return ''.join(iter_question_html(question))
+
+# Function to split the questions into consecutive runs that share a group
+def group_segments(questions):
+    segments = []
+    for question in questions:
+        if not segments or question['Group'] != segments[-1][0]:
+            segments.append((question['Group'], []))
+        segments[-1][1].append(question)
+    return segments
+
+# Function to generate the HTML for one run of questions in a group
+def iter_group_html(group, group_questions, opened, lazy_choices=False, links=None):
+    if opened:
+        yield f"<div class='dropdown'>{group}</div>"
+        yield f"<div class='dropdown-content' id='{group}'>"
+    for question in group_questions:
+        # Add question content
+        yield from iter_question_html(question, lazy_choices, links)
+
+# Function to hash a choice list or cascade that many questions share, once per run
+# digests maps id(value) -> (value, hash); holding the value keeps its id from being reused by another object
+def shared_digest(value, digests):
+    if not value:
+        return value
+    entry = digests.get(id(value))
+    if entry is None or entry[0] is not value:
+        entry = digests[id(value)] = (value, hashlib.sha1(repr(value).encode()).hexdigest())
+    return entry[1]
+
+# Function to fingerprint a run of questions so unchanged groups can be recognised on the next run
+# Questions are fingerprinted from their own fields plus the hash of their shared choice list and cascade
+def group_fingerprint(group, group_questions, opened, lazy_choices=False, digests=None):
+    digests = {} if digests is None else digests
+    digest = hashlib.sha1(repr((RENDERER_VERSION, group, opened, lazy_choices)).encode())
+    rows = []
+    for question in group_questions:
+        fields = question.values()
+        rows.append((fields[:CHOICES_FIELD], shared_digest(fields[CHOICES_FIELD], digests),
+                     fields[CHOICES_FIELD + 1:CASCADE_FIELD], shared_digest(fields[CASCADE_FIELD], digests), fields[CASCADE_FIELD + 1:]))
+    # marshal writes the plain values in C, much faster than repr
+    digest.update(marshal.dumps(rows))
+    return digest.hexdigest()
+
+# Function to reuse the previous run's HTML for a group whose questions are unchanged, rendering it otherwise
+def render_group_fragment(group, group_questions, opened, fragments, lazy_choices=False):
+    fingerprint = group_fingerprint(group, group_questions, opened, lazy_choices, fragments['digests'])
+    fragment = fragments['previous'].get(fingerprint)
+    if fragment is None:
+        fragment = ''.join(iter_group_html(group, group_questions, opened, lazy_choices))
+        fragments['rendered'] += 1
+    else:
+        fragments['reused'] += 1
+    fragments['current'][fingerprint] = fragment
+    return fragment
+
+# Function to render a chunk of question runs in a worker process for render_segments_parallel
+# Questions arrive as tuples of their field values, which are cheaper to send than records
+def render_segment_chunk(chunk, lazy_choices=False, links=None):
+    return [''.join(iter_group_html(group, [Question(*values) for values in group_questions], opened, lazy_choices, links))
+            for group, group_questions, opened in chunk]
+
+# Function to render runs of questions (group, questions, opened) on a process pool, one task per top-level group,
+# returning their HTML in form order, exactly as iter_group_html renders them one after another
+# With fragments, runs unchanged since the last run are reused and only the rest are rendered
+def render_segments_parallel(segments, workers=None, lazy_choices=False, links=None, fragments=None):
+    parts = [None] * len(segments)
+    if fragments is not None:
+        fingerprints = [group_fingerprint(group, group_questions, opened, lazy_choices, fragments['digests']) for group, group_questions, opened in segments]
+        parts = [fragments['previous'].get(fingerprint) for fingerprint in fingerprints]
+
+    # Consecutive runs in the same top-level group go to the same worker
+    chunks = []
+    for position, (group, group_questions, opened) in enumerate(segments):
+        if parts[position] is not None:
+            continue
+        top_group = group_questions[0]['Top_Group']
+        if not chunks or chunks[-1][0] != top_group:
+            chunks.append((top_group, [], []))
+        chunks[-1][1].append(position)
+        chunks[-1][2].append((group, [question.values() for question in group_questions], opened))
+
+    if len(chunks) > 1:
+        # Imported here since multiprocessing only matters to parallel renders and slows every start-up
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rendered = executor.map(render_segment_chunk, [chunk for _, _, chunk in chunks], itertools.repeat(lazy_choices), itertools.repeat(links))
+            for (_, positions, _), chunk_parts in zip(chunks, rendered):
+                for position, part in zip(positions, chunk_parts):
+                    parts[position] = part
+    else:
+        # A single group gains nothing from a pool
+        for _, positions, _ in chunks:
+            for position in positions:
+                group, group_questions, opened = segments[position]
+                parts[position] = ''.join(iter_group_html(group, group_questions, opened, lazy_choices, links))
+
+    if fragments is not None:
+        rendered_count = sum(len(positions) for _, positions, _ in chunks)
+        fragments['rendered'] += rendered_count
+        fragments['reused'] += len(segments) - rendered_count
+        fragments['current'].update(zip(fingerprints, parts))
+    return parts
+
+# Function to start an empty set of group fragments: previous run's HTML by fingerprint, this run's,
+# the shared-value hashes of group_fingerprint and counts of groups reused and rendered
+def new_fragments():
+    return {'previous': {}, 'current': {}, 'digests': {}, 'reused': 0, 'rendered': 0}
+
+# Function to load the group fragments kept from the previous run of a form
+def load_fragments(fragments_path):
+    fragments = new_fragments()
+    try:
+        with open(fragments_path, 'r') as file:
+            fragments['previous'] = json.load(file)
+    except (FileNotFoundError, ValueError):
+        pass  # First run for this form, or a half-written file from an interrupted run
+    return fragments
+
+# Function to keep this run's group fragments for the next run of the form
+def save_fragments(fragments, fragments_path):
+    os.makedirs(os.path.dirname(fragments_path), exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(fragments_path), suffix='.tmp', delete=False) as file:
+        file.write(json.dumps(fragments['current']))
+    os.replace(file.name, fragments_path)
+
+# Function to generate the HTML document as a sequence of chunks
+# Pass fragments from load_fragments() to reuse the HTML of groups that have not changed
+# Pass translations (language -> questions) for one page with a language switcher (see iter_language_html)
+def iter_html(questions, metadata, fragments=None, options=None, translations=None):
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+
+    if translations:
+        yield from iter_language_html(questions, metadata, translations)
+        return
+
+    # Sidebar for groups
+    groups = {}
+    for question in questions:
+        if question['Group'] and question['Group'] not in groups:
+            groups[question['Group']] = (f"#{question['Group']}", question['Group'])
+
+    if not options['search']:
+        yield from iter_page_head(metadata, groups.values())
+        yield from iter_page_body(questions, fragments, options['lazy_choices'], workers=options['render_workers'])
+        yield from iter_page_end(questions, options['lazy_choices'])
+        return
+
+    # Search results jump to question anchors, which also turns relevance references into links
+    links = question_links(questions, '')
+    yield from iter_page_head(metadata, groups.values(), search=True)
+    yield from iter_page_body(questions, lazy_choices=options['lazy_choices'], links=links, workers=options['render_workers'])
+    yield from iter_page_end(questions, options['lazy_choices'], build_search_index([('', questions)]))
+
+# Function to generate one page holding every language version of the dictionary, one shown at a time
+# The untranslated labels come first, named after the form's default language, unless that language has its own columns
+# Choices are always inline here; each version would need its own choice lists to build them in the browser
+def iter_language_html(questions, metadata, translations):
+    default_language = metadata.get('Default Language')
+    versions = list(translations.items())
+    if default_language in translations:
+        versions.sort(key=lambda version: version[0] != default_language)
+    else:
+        versions.insert(0, (default_language or 'Default', questions))
+
+    sidebar_links = []
+    for number, (_, version_questions) in enumerate(versions):
+        groups = []
+        for question in version_questions:
+            if question['Group'] and question['Group'] not in groups:
+                groups.append(question['Group'])
+        sidebar_links.extend((f"#{group}", group, number) for group in groups)
+
+    yield from iter_page_head(metadata, sidebar_links)
+    yield "<p class='language-switcher'><label>Language: <select id='language-select'>"
+    for number, (language, _) in enumerate(versions):
+        yield f"<option value='{number}'>{html.escape(str(language))}</option>"
+    yield "</select></label></p>"
+
+    for number, (_, version_questions) in enumerate(versions):
+        yield f"<div data-language='{number}'>" if number == 0 else f"<div data-language='{number}' style='display: none;'>"
+        yield from iter_page_body(version_questions)
+        yield "</div>"
+
+    yield LANGUAGE_SWITCHER_SCRIPT
+    yield from iter_page_end(questions)
+
+# Function to map each question name to the href of its anchor and the label used for links to it
+# ${name} references can only mean one question, so a repeated name links to its first question
+def question_links(questions, page_file):
+    links = {}
+    for question in questions:
+        if question['Name'] and question['Name'] not in links:
+            links[question['Name']] = (f"{page_file}#{question['Anchor']}", question['Label'] or question['Name'])
+    return links
+
+# Function to build the inverted index the in-page search uses, over names, labels, hints and choice labels
+# pages lists (page file, questions) with '' for the current page; every question is indexed under its own anchor
+# The result is compact JSON: "q" lists [href, heading] per question and "t" lists [token, [question numbers]] sorted by token
+def build_search_index(pages):
+    entries = []
+    postings = {}
+    for page_file, questions in pages:
+        for question in questions:
+            number = len(entries)
+            entries.append([f"{page_file}#{question['Anchor']}", HTML_TAG_RE.sub('', question['Heading'])])
+
+            text = ' '.join(str(value) for value in (question['Name'], question['Label'], question['Hint']) if value)
+            if question['Choices']:
+                text += ' ' + ' '.join(str(choice) for choice in question['Choices'])
+            for token in set(SEARCH_TOKEN_RE.findall(HTML_TAG_RE.sub(' ', text).lower())):
+                postings.setdefault(token, []).append(number)
+
+    return json.dumps({'q': entries, 't': sorted(postings.items())}, ensure_ascii=False, separators=(',', ':'))
+
+# Function to add the search script, either embedding the index or loading it from a shared file
+def iter_search_script(search_index):
+    if search_index.startswith('{'):
+        yield """        <script type="application/json" id="search-index">"""
+        # "</" would end the script element early if a label contained it
+        yield search_index.replace('</', '<\\/')
+        yield """</script>
+        <script>window.SEARCH_INDEX = JSON.parse(document.getElementById('search-index').textContent);</script>
+"""
+    else:
+        yield f"""        <script src="{search_index}"></script>
+"""
+    yield SEARCH_SCRIPT
+
+# Function to generate the start of a page, with sidebar links given as (href, text) pairs
+# A link given as (href, text, version) only shows with that language version (see iter_language_html)
+# With search a search box is added to the sidebar (see iter_search_script)
+def iter_page_head(metadata, sidebar_links, search=False):
+    # HTML Structure
+    yield f"""
+    <html>
+    <head>
+        <title>{metadata['Form Title']}</title>
+        <style>
+            body {{
+                font-family: 'Open Sans', sans-serif;
+                background-color: #f9f9f9;
+                color: #333;
+            }}
+            .sidebar {{
+                width: 250px;
+                float: left;
+                background-color: #2c3e50;
+                padding: 15px;
+                border-right: 1px solid #ccc;
+                height: 100%;
+                position: fixed;
+                color: white;
+            }}
+            .sidebar h2 {{
+                font-size: 20px;
+                color: #ecf0f1;
+                text-align: center;
+                margin-bottom: 20px;
+            }}
+            .sidebar ul {{
+                padding-left: 0;
+                list-style: none;
+            }}
+            .sidebar ul li {{
+                padding: 10px;
+                border-bottom: 1px solid #34495e;
+            }}
+            .sidebar ul li a {{
+                color: #ecf0f1;
+                text-decoration: none;
+            }}
+            .sidebar ul li:hover {{
+                background-color: #34495e;
+            }}
+            .content {{
+                margin-left: 270px;
+                padding: 20px;
+            }}
+            h1, h2, h3 {{
+                margin-bottom: 10px;
+            }}
+            .dropdown {{
+                cursor: pointer;
+                font-weight: bold;
+                margin-bottom: 10px;
+                background-color: #3498db;
+                color: white;
+                padding: 10px;
+                border-radius: 5px;
+            }}
+            .dropdown-content {{
+                display: block;  /* Uncollapsed by default */
+                margin-left: 20px;
+                border-left: 2px solid #ccc;
+                padding-left: 10px;
+            }}
+            .question-box {{
+                margin-bottom: 20px;
+                padding: 15px;
+                border: 1px solid #ccc;
+                border-radius: 5px;
+                background-color: white;
+            }}
+            .question-label {{
+                color: red;
+                margin-bottom: 10px;
+            }}
+            .hint {{
+                color: green;
+            }}
+            .relevant {{
+                color: blue;
+            }}
+            .constraint {{
+                color: red;
+            }}
+            .required {{
+                color: orange;
+            }}
+            .used-by {{
+                color: #8e44ad;
+            }}
+            .choices {{
+                margin-left: 20px;
+            }}
+            ul {{
+                list-style-type: none;
+            }}
+            ul li {{
+                padding: 5px;
+                border-bottom: 1px solid #ddd;
+            }}
+            ul li:hover {{
+                background-color: #eee;
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="sidebar">
+            <h2>Groups</h2>
+            <ul>
+    """
+
+    if search:
+        yield SEARCH_BOX_HTML
+
+    for href, text, *version in sidebar_links:
+        if not version:
+            yield f"<li><a href='{href}'>{text}</a></li>"
+        elif version[0] == 0:
+            yield f"<li data-language='{version[0]}'><a href='{href}'>{text}</a></li>"
+        else:
+            yield f"<li data-language='{version[0]}' style='display: none;'><a href='{href}'>{text}</a></li>"
+
+    yield f"""
+            </ul>
+        </div>
+        <div class="content">
+            <h1>{metadata['Form Title']}</h1>
+            <h2>ID: {metadata['Form ID']}</h2>
+            <h2>Version: {metadata['Version']}</h2>
+    """
+
+# Function to generate the questions of a page
+# With links (question name -> href) each question gets an anchor and its relevance references link to the question they use
+# workers is the number of processes to render large forms with (None: one per CPU); False renders serially
+def iter_page_body(questions, fragments=None, lazy_choices=False, links=None, workers=False):
+    # Questions before the first group are not wrapped in a dropdown
+    segments = [(group, group_questions, bool(position) or group is not None) for position, (group, group_questions) in enumerate(group_segments(questions))]
+    if fragments is not None and links is not None:
+        fragments = None  # Fragments are kept without links
+
+    # Large forms can render their groups in parallel; for small ones (or a single CPU) the pool costs more than it saves
+    parts = None
+    cpus = os.cpu_count() or 1
+    if workers is not False and len(questions) >= PARALLEL_RENDER_MIN_QUESTIONS and cpus > 1 and (workers or cpus) > 1:
+        parts = render_segments_parallel(segments, workers, lazy_choices, links, fragments)
+
+    # Generate questions HTML with collapsible groups, one fragment per run of questions in the same group
+    previous_group = None
+    for position, (group, group_questions, opened) in enumerate(segments):
+        if position and previous_group is not None:
+            yield "</div>"  # Close previous group's dropdown content
+        previous_group = group
+
+        if parts is not None:
+            yield parts[position]
+        elif fragments is None:
+            yield from iter_group_html(group, group_questions, opened, lazy_choices, links)
+        else:
+            yield render_group_fragment(group, group_questions, opened, fragments, lazy_choices)
+
+    # Close last group
+    yield "</div>"
+
+# Function to generate the end of a page
+# search_index is the JSON from build_search_index() to embed, or the file name of a script that defines it
+def iter_page_end(questions, lazy_choices=False, search_index=None):
+    # Close HTML structure
+    if lazy_choices:
+        yield from iter_lazy_choices_script(questions)
+    else:
+        yield from iter_choices_script()
+
+    if search_index is not None:
+        yield from iter_search_script(search_index)
+
+    yield """    </body>
+    </html>
+    """
+
+# Function to close the content and add the script that shows and hides inline choices
+def iter_choices_script():
+    yield """
+        </div>
+
+        <script>
+            document.querySelectorAll('.choices-btn').forEach(function(button) {
+                button.addEventListener('click', function() {
+                    const choices = this.nextElementSibling;
+                    if (choices.style.display === 'none' || choices.style.display === '') {
+                        choices.style.display = 'block';
+                        this.innerHTML = 'Hide Choices';
+                    } else {
+                        choices.style.display = 'none';
+                        this.innerHTML = 'Show Choices';
+                    }
+                });
+            });
+        </script>
+"""
+
+# Function to close the page with each distinct choice list embedded once as JSON
+# and a script that builds a question's list only when its button is clicked
+def iter_lazy_choices_script(questions):
+    choice_lists = {}
+    for question in questions:
+        if question['Choices'] and question['List_Name'] not in choice_lists:
+            # Labels are shown exactly as the inline renderer would print them
+            choice_lists[question['List_Name']] = [str(choice) for choice in question['Choices']]
+
+    yield """
+        </div>
+
+        <script type="application/json" id="choice-lists">"""
+    # "</" would end the script element early if a label contained it
+    yield json.dumps(choice_lists, ensure_ascii=False).replace('</', '<\\/')
+    yield """</script>
+        <script>
+            const choiceLists = JSON.parse(document.getElementById('choice-lists').textContent);
+            const ROW_HEIGHT = 31;          // Height of one choice row in a virtual list
+            const VIRTUAL_THRESHOLD = 200;  // Longer lists only render the rows in view
+
+            function renderChoiceWindow(box, labels) {
+                const first = Math.max(0, Math.floor(box.scrollTop / ROW_HEIGHT) - 10);
+                const last = Math.min(labels.length, first + Math.ceil(box.clientHeight / ROW_HEIGHT) + 20);
+                const list = box.querySelector('ul');
+                list.style.top = (first * ROW_HEIGHT) + 'px';
+                list.innerHTML = labels.slice(first, last).map(function(label) {
+                    return "<li style='height: " + ROW_HEIGHT + "px; box-sizing: border-box; overflow: hidden; white-space: nowrap;'>" + label + "</li>";
+                }).join('');
+            }
+
+            function buildChoices(container, labels) {
+                if (labels.length <= VIRTUAL_THRESHOLD) {
+                    container.innerHTML = '<ul>' + labels.map(function(label) { return '<li>' + label + '</li>'; }).join('') + '</ul>';
+                    return;
+                }
+                container.style.height = '400px';
+                container.style.overflowY = 'auto';
+                container.style.position = 'relative';
+                container.innerHTML = "<div style='height: " + (labels.length * ROW_HEIGHT) + "px;'></div><ul style='position: absolute; left: 0; right: 0; margin: 0; padding: 0;'></ul>";
+                container.addEventListener('scroll', function() { renderChoiceWindow(container, labels); });
+                renderChoiceWindow(container, labels);
+            }
+
+            document.querySelectorAll('.choices-btn').forEach(function(button) {
+                button.addEventListener('click', function() {
+                    const choices = this.nextElementSibling;
+                    if (choices.style.display === 'none' || choices.style.display === '') {
+                        choices.style.display = 'block';
+                        if (!choices.dataset.built) {
+                            buildChoices(choices, choiceLists[this.dataset.list] || []);
+                            choices.dataset.built = 'true';
+                        }
+                        this.innerHTML = 'Hide Choices';
+                    } else {
+                        choices.style.display = 'none';
+                        this.innerHTML = 'Show Choices';
+                    }
+                });
+            });
+        </script>
+"""
+
+# Function to stream the HTML document to a file path, an open file-like object or '-' for stdout
+# With the shard option output_html is the index page and one page per top-level group is written next to it
+# translations (language -> questions) puts every language on one page with a switcher
+@pipeline_stage('render')
+def save_to_html(questions, metadata, output_html, fragments=None, options=None, translations=None):
+    if options and options.get('shard'):
+        save_sharded_html(questions, metadata, output_html, options)
+    elif hasattr(output_html, 'write'):
+        write_chunks(output_html, iter_html(questions, metadata, fragments, options, translations))
+    elif output_html == '-':
+        write_chunks(sys.stdout, iter_html(questions, metadata, fragments, options, translations))
+    else:
+        # Write to the output HTML file
+        with open(output_html, 'w') as file:
+            write_chunks(file, iter_html(questions, metadata, fragments, options, translations))
+
+# Function to turn a title into a short lowercase piece of a file name
+def file_slug(title, fallback):
+    return re.sub(r'[^A-Za-z0-9]+', '_', str(title)).strip('_').lower()[:40] or fallback
+
+# Function to name the dictionary for one language, next to the main output: <stem>_<language>.html
+def language_output_path(output_html, language):
+    stem, extension = os.path.splitext(output_html)
+    return f"{stem}_{file_slug(language, 'language')}{extension or '.html'}"
+
+# Function to split the questions into pages, one per run of questions under the same top-level group
+def shard_pages(questions, output_html):
+    stem = os.path.splitext(os.path.basename(output_html))[0]
+    pages = []
+    for question in questions:
+        if not pages or question['Top_Group'] != pages[-1]['Group']:
+            title = question['Top_Group'] if question['Top_Group'] else 'Ungrouped questions'
+            pages.append({'Group': question['Top_Group'], 'Title': title, 'File': f"{stem}_{len(pages) + 1:02d}_{file_slug(title, 'group')}.html", 'Questions': []})
+        pages[-1]['Questions'].append(question)
+    return pages
+
+# Function to write an index page plus one page per top-level group, so a browser only loads the section being viewed
+def save_sharded_html(questions, metadata, output_html, options=None):
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    output_dir = os.path.dirname(output_html)
+    pages = shard_pages(questions, output_html)
+
+    # Relevance references can point at a question on another page
+    links = {}
+    for page in pages:
+        links.update((name, link) for name, link in question_links(page['Questions'], page['File']).items() if name not in links)
+
+    sidebar_links = [(page['File'], page['Title']) for page in pages]
+
+    # Every page loads the same search index from one script file rather than embedding a copy
+    search_index = None
+    if options['search']:
+        search_index = f"{os.path.splitext(os.path.basename(output_html))[0]}_search.js"
+        with open(os.path.join(output_dir, search_index), 'w') as file:
+            file.write(f"window.SEARCH_INDEX = {build_search_index([(page['File'], page['Questions']) for page in pages])};\n")
+
+    with open(output_html, 'w') as file:
+        write_chunks(file, iter_page_head(metadata, sidebar_links, options['search']))
+        file.write("<ul class='pages'>")
+        for page in pages:
+            file.write(f"<li><a href='{page['File']}'>{page['Title']}</a> ({len(page['Questions'])} questions)</li>")
+        file.write("</ul>")
+        write_chunks(file, iter_page_end([], options['lazy_choices'], search_index))
+
+    for page in pages:
+        with open(os.path.join(output_dir, page['File']), 'w') as file:
+            write_chunks(file, iter_page_head(metadata, sidebar_links, options['search']))
+            file.write(f"<h2>{page['Title']}</h2>")
+            write_chunks(file, iter_page_body(page['Questions'], lazy_choices=options['lazy_choices'], links=links))
+            write_chunks(file, iter_page_end(page['Questions'], options['lazy_choices'], search_index))
+
+# Function to write chunks as they are produced so the page is never held in memory whole
+def write_chunks(file, chunks):
+    for chunk in chunks:
+        file.write(chunk)
+
+# Function to read the form metadata from the settings sheet
+# Blank cells are None from either reader
+def get_form_metadata(settings_df):
+    def first_value(column):
+        value = column_values(settings_df, column)[0]
+        return None if is_blank(value) else value
+
+    return {
+        'Form Title': first_value('form_title'),
+        'Form ID': first_value('form_id'),
+        'Version': first_value('version'),
+        'Default Language': column_strings(settings_df, 'default_language')[0]
+    }
+
+# Version of the form model layout written by dump_form_model; bump when its fields change
+FORM_MODEL_VERSION = 7
+
+# File extensions read and written as a form model instead of a workbook
+FORM_MODEL_EXTENSIONS = ('.json', '.pickle', '.pkl')
+
+# Function to parse a form once into a model that every output can be rendered from
+# The model is a plain dict:
+#   Metadata     - form title, ID, version and default language from the settings sheet
+#   Questions    - the Question records from process_survey, in survey order
+#   Languages    - the languages of the label::<language> and hint::<language> columns
+#   Translations - with translations, the Question records in each of those languages
+#   Groups       - the group/repeat tree; each node has Name, Label, Kind ('group' or 'repeat'),
+#                  Relevant, nested Groups and the positions of its own Questions
+#   Choice_Lists - every choice list by list_name, each choice with Name, Label and Extra columns
+#   Dependencies - the graph of ${} references between fields, from build_dependency_graph
+#   External_Choices - with form_dir, a read_external_choices() summary of each external choice file,
+#                  resolved relative to form_dir
+@pipeline_stage('parse')
+def build_form_model(sheets, translations=False, form_dir=None):
+    survey_df, choices_df, settings_df = sheets
+    external_choices = {}
+    if form_dir is not None:
+        external_choices = {file_name: read_external_choices(os.path.join(form_dir, file_name)) for file_name in external_choice_files(survey_df)}
+
+    groups = []
+    dependencies = {}
+    questions = process_survey(survey_df, choices_df, group_tree=groups, dependencies=dependencies, external_choices=external_choices)
+    languages = form_languages(survey_df, choices_df)
+
+    # Settings cells can come back as numpy scalars, which JSON cannot write
+    metadata = {key: value.item() if hasattr(value, 'item') else value for key, value in get_form_metadata(settings_df).items()}
+
+    return {
+        'Model_Version': FORM_MODEL_VERSION,
+        'Metadata': metadata,
+        'Questions': questions,
+        'Languages': languages,
+        'Translations': {language: process_survey(survey_df, choices_df, language=language, external_choices=external_choices) for language in languages} if translations else {},
+        'Groups': groups,
+        'Choice_Lists': build_choice_index(choices_df),
+        'Dependencies': dependencies,
+        'External_Choices': external_choices
+    }
+
+# Function to check whether a path names a saved form model rather than a workbook
+def is_form_model_path(path):
+    return path.lower().endswith(FORM_MODEL_EXTENSIONS)
+
+# Function to save a form model as JSON (.json) or pickle (any other extension)
+# Each question's choice labels are left out and re-linked to its choice list on load
+@pipeline_stage('save_model')
+def dump_form_model(model, path):
+    def strip_choices(questions):
+        return [Question(**{**question, 'Choices': None}) for question in questions]
+
+    saved = {
+        **model,
+        'Questions': strip_choices(model['Questions']),
+        'Translations': {language: strip_choices(questions) for language, questions in model['Translations'].items()}
+    }
+    if path.lower().endswith('.json'):
+        with open(path, 'w', encoding='utf-8') as file:
+            # Records are written as objects of their fields; anything else JSON cannot hold as text
+            json.dump(saved, file, ensure_ascii=False, default=lambda value: dict(value) if isinstance(value, Record) else str(value))
+    else:
+        # Records are pickled as tuples of their field values, so the file does not depend on
+        # whether this module was run as a script or imported
+        saved['Questions'] = [question.values() for question in saved['Questions']]
+        saved['Translations'] = {language: [question.values() for question in questions] for language, questions in saved['Translations'].items()}
+        saved['Choice_Lists'] = {list_name: [choice.values() for choice in choices] for list_name, choices in model['Choice_Lists'].items()}
+        with open(path, 'wb') as file:
+            pickle.dump(saved, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+# Function to point each select question at its choice list's labels in a language
+# Questions using the same list share one label list, as they do straight out of process_survey
+def link_choice_labels(questions, choice_lists, language=None, external_choices=None):
+    choice_labels = {list_name: [choice_label(choice, language) for choice in choices] for list_name, choices in choice_lists.items()}
+    choice_labels.update((file_name, summary['Labels']) for file_name, summary in (external_choices or {}).items())
+    for question in questions:
+        if 'select_one' in question['Type'] or 'select_multiple' in question['Type']:
+            question['Choices'] = choice_labels.get(question['List_Name'], [])
+
+# Function to load a form model saved by dump_form_model
+@pipeline_stage('load')
+def load_form_model(path):
+    if path.lower().endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as file:
+            model = json.load(file)
+        make_question, make_choice = lambda fields: Question(**fields), lambda fields: Choice(**fields)
+    else:
+        with open(path, 'rb') as file:
+            model = pickle.load(file)
+        make_question, make_choice = lambda values: Question(*values), lambda values: Choice(*values)
+
+    if model.get('Model_Version') != FORM_MODEL_VERSION:
+        raise ValueError(f"{path} is a version {model.get('Model_Version')} form model; expected version {FORM_MODEL_VERSION}")
+
+    model['Questions'] = [make_question(question) for question in model['Questions']]
+    model['Translations'] = {language: [make_question(question) for question in questions] for language, questions in model['Translations'].items()}
+    model['Choice_Lists'] = {list_name: [make_choice(choice) for choice in choices] for list_name, choices in model['Choice_Lists'].items()}
+
+    link_choice_labels(model['Questions'], model['Choice_Lists'], external_choices=model['External_Choices'])
+    for language, questions in model['Translations'].items():
+        link_choice_labels(questions, model['Choice_Lists'], language, model['External_Choices'])
+    return model
+
+# Function to find the default cache directory, following XDG_CACHE_HOME where set
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'xlsx_to_dictionary')
+
+# Function to compute the cache key for a form from its sheet contents, the renderer version and output options
+# The workbook file itself is not hashed because Excel rewrites it (and its mtime) on every save
+# External choice files in form_dir are keyed by size and modification time, as they can be too big to hash
+@pipeline_stage('cache_key')
+def form_cache_key(sheets, options, form_dir=None):
+    digest = hashlib.sha256(f"{RENDERER_VERSION}|{sorted((key, options[key]) for key in OUTPUT_OPTIONS)}".encode())
+    for sheet_name, df in zip(XLSFORM_SHEETS, sheets):
+        digest.update(f"\0{sheet_name}\0{list(df)}".encode())
+        for column in df:
+            # Values are hashed as the text the dictionary shows, so the pandas and streaming readers agree
+            digest.update(repr(column_strings(df, column)).encode())
+    if form_dir is not None:
+        for file_name in external_choice_files(sheets[0]):
+            digest.update(f"\0{file_name}\0{file_signature(os.path.join(form_dir, file_name))}".encode())
+    return digest.hexdigest()
+
+# Function to copy a rendered dictionary to a path, a file-like object or '-' for stdout
+@pipeline_stage('copy')
+def copy_to_output(rendered_html, output_html):
+    with open(rendered_html, 'r') as source:
+        if hasattr(output_html, 'write'):
+            shutil.copyfileobj(source, output_html)
+        elif output_html == '-':
+            shutil.copyfileobj(source, sys.stdout)
+        else:
+            with open(output_html, 'w') as file:
+                shutil.copyfileobj(source, file)
+
+# Function to drop the least recently used cache entries until the cache fits its size limit
+def evict_cache(cache_dir, max_bytes):
+    entries = []
+    fragments_dir = os.path.join(cache_dir, 'fragments')
+    for directory in (cache_dir, fragments_dir):
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.html') or entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another process in a batch run
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# Columns of the flat codebook written by the CSV, Markdown and Excel exports, one row per question
+CODEBOOK_COLUMNS = ('Name', 'Label', 'Type', 'Group', 'Hint', 'Relevant', 'Constraint', 'Required', 'List_Name', 'Choices', 'Used_By')
+
+# Most characters an Excel cell can hold
+EXCEL_CELL_LIMIT = 32767
+
+# Characters XML cannot hold at all, which a workbook cell can still contain
+XML_INVALID_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Writers for --export by file extension; each is called as writer(model, path) and streams the file as it goes
+# Add a writer with the export_writer decorator to support another format
+EXPORT_WRITERS = {}
+
+# Function to register an export writer for one or more file extensions
+def export_writer(*extensions):
+    def register(writer):
+        for extension in extensions:
+            EXPORT_WRITERS[extension] = writer
+        return writer
+    return register
+
+# Function to find the export writer for a path from its extension, or None if no writer handles it
+def find_export_writer(path):
+    return EXPORT_WRITERS.get(os.path.splitext(path)[1].lower())
+
+# Function to list a question's choices as name/label pairs
+# Choices from an external file are only known by label (and only a sample of large files)
+def question_choices(question, choice_lists):
+    if question['List_Name'] in choice_lists:
+        return [(export_text(choice['Name']), export_text(choice['Label'])) for choice in choice_lists[question['List_Name']]]
+    return [(None, label) for label in question['Choices'] or []]
+
+# Function to write a sheet value as exported text: blank is '' and a whole float is its integer,
+# as numeric choice names (1, 0, 99) are read as floats when the column has blank rows
+def export_text(value):
+    if is_blank(value):
+        return ''
+    return filter_value(value)
+
+# Function to list choices in one codebook cell as name=label; ...
+# With a limit, whole entries are kept while they fit and the rest are counted in a note at the end
+def choices_text(choices, limit=None, note=''):
+    entries = [label if name is None else f"{name}={label}" for name, label in choices]
+    text = '; '.join(entries)
+    if limit is None or len(text) <= limit:
+        return text
+    kept = 0
+    length = 100  # Room for the note
+    for entry in entries:
+        length += len(entry) + 2
+        if length > limit:
+            break
+        kept += 1
+    return '; '.join(entries[:kept]) + f"; …({len(entries) - kept} more{note})"
+
+# Function to produce the codebook rows of a form model as lists of text, in CODEBOOK_COLUMNS order
+# choices_limit caps the length of the Choices cell, for formats whose cells have a size limit
+def iter_codebook_rows(model, choices_limit=None):
+    for question in model['Questions']:
+        choices = question_choices(question, model['Choice_Lists'])
+        note = ', see the choices sheet' if question['List_Name'] in model['Choice_Lists'] else ''
+        yield [
+            question['Name'],
+            question['Label'],
+            question['Type'],
+            question['Group'],
+            question['Hint'],
+            question['Relevant_Expression'],
+            question['Constraint'],
+            question['Required'],
+            question['List_Name'],
+            choices_text(choices, choices_limit, note),
+            ', '.join(question['Used_By'] or [])
+        ]
+
+# Function to write the codebook as CSV
+@export_writer('.csv')
+def write_csv_codebook(model, path):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(CODEBOOK_COLUMNS)
+        for row in iter_codebook_rows(model):
+            writer.writerow(['' if value is None else value for value in row])
+
+# Function to write the form as JSON: the metadata, then each question with its choices as a Name/Label list
+# Questions are written one at a time, so the document is never held in memory whole
+@export_writer('.json')
+def write_json_export(model, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('{"Metadata": ')
+        json.dump(model['Metadata'], file, ensure_ascii=False, default=str)
+        file.write(', "Questions": [')
+        for position, question in enumerate(model['Questions']):
+            record = {key: value for key, value in zip(Question.__slots__, question.values()) if key not in ('Choices', 'Cascade')}
+            record['Choices'] = [{'Name': name, 'Label': label} for name, label in question_choices(question, model['Choice_Lists'])]
+            # json.dumps encodes each question in C; json.dump would write it piece by piece
+            file.write((',\n' if position else '\n') + json.dumps(record, ensure_ascii=False, default=str))
+        file.write('\n]}\n')
+
+# Function to make a value safe for one cell of a Markdown table
+def markdown_cell(value):
+    if value is None:
+        return ''
+    return str(value).replace('\\', '\\\\').replace('|', '\\|').replace('\r', '').replace('\n', '<br>')
+
+# Function to write the codebook as Markdown: the form title, then a table of questions per top-level group
+@export_writer('.md', '.markdown')
+def write_markdown_codebook(model, path):
+    header = '| ' + ' | '.join(column.replace('_', ' ') for column in CODEBOOK_COLUMNS) + ' |\n'
+    rule = '|' + '---|' * len(CODEBOOK_COLUMNS) + '\n'
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(f"# {markdown_cell(model['Metadata']['Form Title'])}\n\n")
+        file.write(f"Form ID: {markdown_cell(model['Metadata']['Form ID'])}, version {markdown_cell(model['Metadata']['Version'])}\n")
+        section = None
+        for position, (question, row) in enumerate(zip(model['Questions'], iter_codebook_rows(model))):
+            if not position or question['Top_Group'] != section:
+                section = question['Top_Group']
+                file.write(f"\n## {markdown_cell(question['Top_Group'] or 'Ungrouped')}\n\n{header}{rule}")
+            file.write('| ' + ' | '.join(markdown_cell(value) for value in row) + ' |\n')
+
+# Function to stream rows into a worksheet part, with numbers as values and text as inline strings
+# Text is cut to EXCEL_CELL_LIMIT characters, the most an Excel cell holds
+def write_worksheet(file, rows):
+    file.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+               b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+    letters = []
+    for row_number, row in enumerate(rows, start=1):
+        while len(letters) < len(row):
+            letters.append(column_letters(len(letters)))
+        cells = []
+        for column, value in zip(letters, row):
+            if value is None or value == '':
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                cells.append(f'<c r="{column}{row_number}"><v>{value}</v></c>')
+            else:
+                text = html.escape(XML_INVALID_RE.sub('', str(value))[:EXCEL_CELL_LIMIT], quote=False)
+                cells.append(f'<c r="{column}{row_number}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        file.write(f'<row r="{row_number}">{"".join(cells)}</row>'.encode('utf-8'))
+    file.write(b'</sheetData></worksheet>')
+
+# Function to turn a 0-based column number into its spreadsheet letters (0 -> A, 26 -> AA)
+def column_letters(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+# Function to write a minimal .xlsx workbook from sheet name -> rows (lists of values, the first being the header)
+# The parts are written directly so each sheet streams into the archive rather than being built up in memory
+def write_xlsx(path, sheets):
+    sheet_entries = ''.join(f'<sheet name="{html.escape(name)}" sheetId="{number}" r:id="rId{number}"/>' for number, name in enumerate(sheets, start=1))
+    sheet_rels = ''.join(f'<Relationship Id="rId{number}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{number}.xml"/>'
+                         for number in range(1, len(sheets) + 1))
+    sheet_types = ''.join(f'<Override PartName="/xl/worksheets/sheet{number}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                          for number in range(1, len(sheets) + 1))
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                         '<Default Extension="xml" ContentType="application/xml"/>'
+                         '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                         f'{sheet_types}</Types>')
+        archive.writestr('_rels/.rels',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                         '</Relationships>')
+        archive.writestr('xl/workbook.xml',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                         'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                         f'<sheets>{sheet_entries}</sheets></workbook>')
+        archive.writestr('xl/_rels/workbook.xml.rels',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         f'{sheet_rels}</Relationships>')
+        for number, rows in enumerate(sheets.values(), start=1):
+            # force_zip64 lets a sheet grow past 2 GB, as its size is not known before it is written
+            with archive.open(f'xl/worksheets/sheet{number}.xml', 'w', force_zip64=True) as file:
+                write_worksheet(file, rows)
+
+# Function to write the codebook as an Excel workbook: a 'codebook' sheet of questions and a 'choices' sheet
+# of every choice list, in the layout of an XLSForm choices sheet
+# Choice lists too long for one cell are cut short in the codebook sheet and given in full in the choices sheet
+@export_writer('.xlsx')
+def write_excel_codebook(model, path):
+    def choice_rows():
+        yield ['list_name', 'name', 'label']
+        for list_name, choices in model['Choice_Lists'].items():
+            for choice in choices:
+                yield [list_name, export_text(choice['Name']), export_text(choice['Label'])]
+
+    write_xlsx(path, {'codebook': itertools.chain([CODEBOOK_COLUMNS], iter_codebook_rows(model, EXCEL_CELL_LIMIT)), 'choices': choice_rows()})
+
+# Function to write every export of a form model, all from the one parse
+@pipeline_stage('export')
+def save_exports(model, paths):
+    for path in paths:
+        find_export_writer(path)(model, path)
+
+# Function to write the files saved alongside the dictionary: the form model, the dependency graph and any exports
+def save_model_files(model, options):
+    if options['save_model']:
+        dump_form_model(model, options['save_model'])
+    if options['dependency_json']:
+        with open(options['dependency_json'], 'w', encoding='utf-8') as file:
+            json.dump(model['Dependencies'], file, ensure_ascii=False, indent=2)
+    if options['exports']:
+        save_exports(model, options['exports'])
+
+# Function to render a form model, following the languages option:
+# 'switcher' puts every language on one page and 'each' also writes <stem>_<language>.html per language
+def save_model_html(model, output_html, fragments=None, options=None):
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    if options['languages'] == 'switcher' and model['Translations']:
+        save_to_html(model['Questions'], model['Metadata'], output_html, options=options, translations=model['Translations'])
+        return
+
+    save_to_html(model['Questions'], model['Metadata'], output_html, fragments, options)
+    if options['languages'] == 'each':
+        for language, questions in model['Translations'].items():
+            save_to_html(questions, model['Metadata'], language_output_path(output_html, language), options=options)
+
+# Function to load, parse and render a single form
+# Returns the skipped row counts and whether the dictionary came from the cache
+def build_dictionary(file_path, output_html, options=None):
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+
+    # A saved form model is already parsed, so it is rendered straight away
+    if is_form_model_path(file_path):
+        model = load_form_model(file_path)
+        save_model_files(model, options)
+        save_model_html(model, output_html, options=options)
+        return {}, False
+
+    # Load the relevant sheets: survey, choices and settings
+    sheets, skipped_rows = load_xlsform(file_path, use_pandas=options['use_pandas'], max_empty_rows=options['max_empty_rows'])
+    # External choice files are named relative to the form
+    form_dir = os.path.dirname(os.path.abspath(file_path))
+
+    # A sharded dictionary or one per language is several files, so it is always rendered rather than cached
+    cache_dir = options['cache_dir'] if not options['shard'] and options['languages'] != 'each' else None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cached_html = os.path.join(cache_dir, form_cache_key(sheets, options, form_dir) + '.html')
+        if not options['refresh_cache'] and os.path.exists(cached_html):
+            os.utime(cached_html)  # Mark as recently used for LRU eviction
+            copy_to_output(cached_html, output_html)
+            if options['save_model'] or options['dependency_json'] or options['exports']:
+                save_model_files(build_form_model(sheets, translations=bool(options['save_model']), form_dir=form_dir), options)
+            return skipped_rows, True
+
+    # Parse the form once into the model that the dictionary (and a saved model) is built from
+    # Every language is parsed from the same load when the dictionary or the saved model needs them
+    model = build_form_model(sheets, translations=bool(options['languages'] or options['save_model']), form_dir=form_dir)
+    save_model_files(model, options)
+
+    if not cache_dir:
+        # Save the questions to an HTML document
+        save_model_html(model, output_html, options=options)
+        return skipped_rows, False
+
+    # Groups whose questions are unchanged since the last run of this form reuse their HTML
+    fragments_path = os.path.join(cache_dir, 'fragments', hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest() + '.json')
+    fragments = load_fragments(fragments_path)
+    if options['refresh_cache']:
+        fragments['previous'] = {}
+
+    # Render into the cache first (atomically, since batch workers share it) and copy out from there
+    with tempfile.NamedTemporaryFile('w', dir=cache_dir, suffix='.tmp', delete=False) as file:
+        save_model_html(model, file, fragments, options)
+    os.replace(file.name, cached_html)
+    save_fragments(fragments, fragments_path)
+    copy_to_output(cached_html, output_html)
+    evict_cache(cache_dir, options['cache_size_mb'] * 1024 * 1024)
+
+    if fragments['reused']:
+        print(f"Re-rendered {fragments['rendered']} of {fragments['rendered'] + fragments['reused']} groups; the rest were unchanged", file=sys.stderr)
+    return skipped_rows, False
+
+# Function to find the XLSForms for a batch run from a directory or a glob pattern
+def find_forms(source):
+    pattern = os.path.join(source, '*.xlsx') if os.path.isdir(source) else source
+    # Skip the ~$ lock files Excel leaves next to open workbooks
+    return sorted(path for path in glob.glob(pattern, recursive=True) if not os.path.basename(path).startswith('~$'))
+
+# Function run in each worker process; errors are returned rather than raised so one bad form does not stop the batch
+def render_batch_form(file_path, output_html, options=None):
+    start = time.perf_counter()
+    cached = False
+    try:
+        _, cached = build_dictionary(file_path, output_html, options)
+        error = None
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    return {'File': file_path, 'Output': output_html, 'Error': error, 'Cached': cached, 'Seconds': time.perf_counter() - start}
+
+# Function to render every form in a directory or glob on a process pool
+def run_batch(source, output_dir, workers=None, options=None):
+    forms = find_forms(source)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # One <form name>.html per form; clashing names (and "index") get a numeric suffix
+    output_names = {'index.html'}
+    jobs = []
+    for file_path in forms:
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        output_name = f"{stem}.html"
+        suffix = 1
+        while output_name in output_names:
+            suffix += 1
+            output_name = f"{stem}_{suffix}.html"
+        output_names.add(output_name)
+        jobs.append((file_path, os.path.join(output_dir, output_name)))
+
+    # Imported here since multiprocessing only matters to batch runs and slows every start-up
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    results = {}
+    batch_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_batch_form, file_path, output_html, options): (file_path, output_html) for file_path, output_html in jobs}
+        for future in as_completed(futures):
+            file_path, output_html = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                # The worker itself died (e.g. killed for memory), not just the form
+                result = {'File': file_path, 'Output': output_html, 'Error': f"{type(exc).__name__}: {exc}", 'Cached': False, 'Seconds': None}
+            results[file_path] = result
+
+            status = 'FAILED' if result['Error'] else 'cached' if result['Cached'] else 'ok'
+            seconds = f"{result['Seconds']:.2f}s" if result['Seconds'] is not None else '-'
+            print(f"[{len(results)}/{len(jobs)}] {status} {file_path} ({seconds}){': ' + result['Error'] if result['Error'] else ''}", file=sys.stderr)
+
+    # Report in form order rather than completion order
+    results = [results[file_path] for file_path, _ in jobs]
+    save_batch_index(results, os.path.join(output_dir, 'index.html'))
+
+    failed = sum(1 for result in results if result['Error'])
+    print(f"Rendered {len(results) - failed} of {len(results)} forms in {time.perf_counter() - batch_start:.2f}s ({failed} failed)", file=sys.stderr)
+    return results
+
+# Function to write the index page linking every dictionary in a batch run
+def save_batch_index(results, output_html):
+    with open(output_html, 'w') as file:
+        file.write("""
+    <html>
+    <head>
+        <title>Data dictionaries</title>
+        <style>
+            body {
+                font-family: 'Open Sans', sans-serif;
+                background-color: #f9f9f9;
+                color: #333;
+                padding: 20px;
+            }
+            ul {
+                list-style-type: none;
+            }
+            ul li {
+                padding: 5px;
+                border-bottom: 1px solid #ddd;
+            }
+            .failed {
+                color: red;
+            }
+        </style>
+    </head>
+    <body>
+        <h1>Data dictionaries</h1>
+        <ul>
+    """)
+        for result in results:
+            form_name = html.escape(os.path.basename(result['File']))
+            if result['Error']:
+                file.write(f"<li class='failed'>{form_name}: {html.escape(result['Error'])}</li>")
+            else:
+                file.write(f"<li><a href='{html.escape(os.path.basename(result['Output']))}'>{form_name}</a></li>")
+        file.write("""
+        </ul>
+    </body>
+    </html>
+    """)
+
+# Function to get a cheap signature of a file that changes whenever it is saved
+def file_signature(file_path):
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None  # Excel briefly removes the file while saving
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Function to keep rebuilding a form's dictionary while the workbook is edited
+# The process, its imports and the group fragments stay warm between rebuilds
+def watch_form(file_path, output_html, options=None, interval=0.5, debounce=1.0):
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    fragments = new_fragments()
+    form_dir = os.path.dirname(os.path.abspath(file_path))
+    last_key = None
+    last_signature = None
+
+    print(f"Watching {file_path} (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        while True:
+            signature = file_signature(file_path)
+            if signature is None or signature == last_signature:
+                time.sleep(interval)
+                continue
+
+            # Debounce: wait until the file has stopped changing before reading it
+            changed_at = time.time()
+            time.sleep(debounce)
+            if file_signature(file_path) != signature:
+                continue
+            last_signature = signature
+
+            start = time.perf_counter()
+            try:
+                sheets, _ = load_xlsform(file_path, use_pandas=options['use_pandas'], max_empty_rows=options['max_empty_rows'])
+            except Exception as exc:
+                # Usually a half-written workbook; the next save will trigger another attempt
+                print(f"Could not read {file_path}: {type(exc).__name__}: {exc}", file=sys.stderr)
+                continue
+
+            # Saving without editing (or editing other sheets) leaves the dictionary as it is
+            key = form_cache_key(sheets, options, form_dir)
+            if key == last_key:
+                print("Saved without changes to the survey, choices or settings sheets", file=sys.stderr)
+                continue
+            last_key = key
+
+            fragments['previous'], fragments['current'], fragments['digests'] = fragments['current'], {}, {}
+            fragments['reused'] = fragments['rendered'] = 0
+            try:
+                model = build_form_model(sheets, form_dir=form_dir)
+                questions = model['Questions']
+                save_to_html(questions, model['Metadata'], output_html, fragments, options)
+            except Exception as exc:
+                print(f"Could not build the dictionary: {type(exc).__name__}: {exc}", file=sys.stderr)
+                last_key = None
+                continue
+
+            rebuild_seconds = time.perf_counter() - start
+            latency_seconds = time.time() - signature[0] / 1e9
+            print(f"{time.strftime('%H:%M:%S')} rebuilt {output_html}: {len(questions)} questions, "
+                  f"{fragments['rendered']} of {fragments['rendered'] + fragments['reused']} groups re-rendered, "
+                  f"rebuild {rebuild_seconds:.2f}s, {latency_seconds:.2f}s since save "
+                  f"({time.time() - changed_at:.2f}s since the change was noticed)", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+# Function to print a profile report as a table on stderr
+def print_profile_report(report):
+    print(f"{'Stage':12} {'Seconds':>9} {'Peak MB':>9}", file=sys.stderr)
+    for stage in report['Stages']:
+        print(f"{stage['Stage']:12} {stage['Seconds']:9.3f} {stage['Peak_MB']:9.1f}", file=sys.stderr)
+    print(f"{'total':12} {report['Total_Seconds']:9.3f}", file=sys.stderr)
+    for name, counters in report.get('Counters', {}).items():
+        print(f"{name}: " + ', '.join(f"{key.replace('_', ' ').lower()} {value}" for key, value in counters.items()), file=sys.stderr)
+
+def main():
+    # Parse the command-line argument
+    parser = argparse.ArgumentParser(description='Process ODK XLSX file to generate a data dictionary in HTML format with sidebar and dropdown menus.')
+    parser.add_argument('file', type=str, help='Path to the ODK XLSX file or a saved form model (a directory or glob pattern with --batch)')
+    parser.add_argument('output', type=str, help="Output HTML file path ('-' for stdout; the output directory with --batch)")
+    parser.add_argument('--pandas-reader', action='store_true', help='Load the workbook with pandas/openpyxl instead of the built-in streaming reader')
+    parser.add_argument('--max-empty-rows', type=int, default=MAX_EMPTY_ROWS, help='Stop reading a sheet after this many consecutive empty rows')
+    parser.add_argument('--batch', action='store_true', help='Render every XLSForm in a directory or glob into the output directory, plus an index page')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for --batch (default: one per CPU)')
+    parser.add_argument('--cache-dir', type=str, default=default_cache_dir(), help='Directory for cached dictionaries (default: %(default)s)')
+    parser.add_argument('--cache-size-mb', type=int, default=DEFAULT_OPTIONS['cache_size_mb'], help='Size limit of the cache; least recently used entries are evicted first')
+    parser.add_argument('--no-cache', action='store_true', help='Build without the cache: nothing is read from it or written to it')
+    parser.add_argument('--refresh-cache', action='store_true', help='Rebuild even if a cached dictionary exists for this form, and update the cache')
+    parser.add_argument('--lazy-choices', action='store_true', help='Embed each choice list once as JSON and build it in the browser when "Show Choices" is clicked')
+    parser.add_argument('--shard', action='store_true', help='Write one page per top-level group next to OUTPUT, which becomes an index page')
+    parser.add_argument('--search', action='store_true', help='Embed a search index and a search box for question names, labels, hints and choices')
+    parser.add_argument('--render-workers', type=int, default=None, metavar='N',
+                        help=f'Render the top-level groups of forms with {PARALLEL_RENDER_MIN_QUESTIONS:,}+ questions on N worker processes (0: one per CPU)')
+    parser.add_argument('--save-model', type=str, default=None, help='Also save the parsed form as a model (.json, or pickle for any other extension) that can be given as FILE later')
+    parser.add_argument('--dependency-json', type=str, default=None, help='Also save the graph of ${} references between fields (and the fields using each one) as JSON')
+    parser.add_argument('--export', action='append', default=None, metavar='PATH',
+                        help=f"Also write the form in another format, chosen by the extension ({', '.join(sorted(EXPORT_WRITERS))}); can be given several times")
+    parser.add_argument('--languages', choices=('each', 'switcher'), default=None,
+                        help="Render the label::<language> columns too: 'each' writes OUTPUT_<language>.html per language, 'switcher' puts them all on one page")
+    parser.add_argument('--profile', action='store_true', help='Report the wall time and peak memory of each stage on stderr (memory tracing slows the build)')
+    parser.add_argument('--profile-json', type=str, default=None, help='Also write the --profile report as JSON to this path')
+    parser.add_argument('--cprofile-dir', type=str, default=None, help='Save cProfile statistics for the parse and render stages as <stage>.prof in this directory')
+    parser.add_argument('--watch', action='store_true', help='Keep running and rebuild the dictionary whenever the workbook is saved')
+    parser.add_argument('--watch-interval', type=float, default=0.5, help='Seconds between checks of the workbook in --watch mode')
+    parser.add_argument('--debounce', type=float, default=1.0, help='Seconds the workbook must stay unchanged before a --watch rebuild')
+    
+    args = parser.parse_args()
+
+    options = {
+        'use_pandas': args.pandas_reader,
+        'max_empty_rows': args.max_empty_rows,
+        'cache_dir': None if args.no_cache else args.cache_dir,
+        'cache_size_mb': args.cache_size_mb,
+        'refresh_cache': args.refresh_cache,
+        'lazy_choices': args.lazy_choices,
+        'shard': args.shard,
+        'search': args.search,
+        'save_model': args.save_model,
+        'languages': args.languages,
+        'dependency_json': args.dependency_json,
+        'exports': args.export or (),
+        'render_workers': False if args.render_workers is None else args.render_workers or None
+    }
+
+    if args.shard and args.output == '-':
+        parser.error('--shard writes several files and needs an output path, not stdout')
+
+    if args.languages == 'each' and args.output == '-':
+        parser.error('--languages each writes several files and needs an output path, not stdout')
+    if args.languages == 'switcher' and (args.lazy_choices or args.search or args.shard):
+        parser.error('--languages switcher cannot be combined with --lazy-choices, --search or --shard')
+    if args.languages and args.watch:
+        parser.error('--languages cannot be combined with --watch')
+
+    if (args.save_model or args.dependency_json) and (args.batch or args.watch):
+        parser.error('--save-model and --dependency-json save a single form and cannot be combined with --batch or --watch')
+
+    for path in args.export or ():
+        if find_export_writer(path) is None:
+            parser.error(f"--export {path}: unknown format; use one of {', '.join(sorted(EXPORT_WRITERS))}")
+    if args.export and (args.batch or args.watch):
+        parser.error('--export saves a single form and cannot be combined with --batch or --watch')
+
+    if args.render_workers is not None and args.batch:
+        parser.error('--render-workers cannot be combined with --batch, which already renders forms in parallel')
+
+    profile = args.profile or args.profile_json or args.cprofile_dir
+    if profile and (args.batch or args.watch):
+        parser.error('--profile reports on a single build and cannot be combined with --batch or --watch')
+
+    if args.batch:
+        results = run_batch(args.file, args.output, workers=args.workers, options=options)
+        if any(result['Error'] for result in results):
+            sys.exit(1)
+        return
+
+    if args.watch:
+        watch_form(args.file, args.output, options, interval=args.watch_interval, debounce=args.debounce)
+        return
+
+    if profile:
+        report = {'File': args.file, 'Stages': []}
+        STAGE_HOOKS.append(make_profile_hook(report, args.cprofile_dir))
+        start = time.perf_counter()
+
+    skipped_rows, cached = build_dictionary(args.file, args.output, options)
 
-            # Calculate indentation level based on group nesting
-            indent_level = len(group_stack)
-            margin = 20 * indent_level  # Indentation based on group level
+    if profile:
+        report['Total_Seconds'] = time.perf_counter() - start
+        report['Counters'] = {'Expression_Cache': expression_cache_info()}
+        print_profile_report(report)
+        if args.profile_json:
+            with open(args.profile_json, 'w') as file:
+                json.dump(report, file, indent=2)
+    for sheet_name, skipped in skipped_rows.items():
+        if skipped:
+            print(f"Skipped {skipped} empty formatted rows at the end of the '{sheet_name}' sheet", file=sys.stderr)
+    if cached:
+        print("Form unchanged since the last run; using the cached dictionary", file=sys.stderr)
 
-            # Add a visual bar for the group or repeat beginning with appropriate nesting
-            if 'begin_group' in row_type:
-                html_content += f"<div class='group-info' style='margin-left:{margin}px;'>Group: {name}, Label: {label}, Relevant: {relevant}</div>"
-                if 'begin_repeat' in row_type:
-                    html_content += f"<div class='repeat-info' style='margin-left:{margin}px;'>Repeat: {name}, Label: {label}, Relevant: {relevant}</div>"
-
-
-                    if 'begin_group' in row_type:
-                        group_stack.append(label if label else name)  # Use label if available
-
-
-
-                        # Handle group endings with indentation reset
-
-                        if 'end_group' in row_type or 'end_repeat' in row_type:
-                            if group_stack:
-                                group_stack.pop()  # Pop from stack to reduce indentation
-
-                                if group_stack:
-                                    group_stack.pop()  # Pop from stack to reduce indentation
-
-
-                                    if 'end_group' in row_type:
-                                        if group_stack:
-                                            group_stack.pop()
-
-
-                                            # Skip if both label and name are NaN
-                                            if not label and not name:
-
-
-                                                # Create the main heading: label (name)
-                                                heading = label if label else ""
-                                                if name:
-                                                    heading += f" [{name}]" if label else name
-
-                                                    # Replace variable names in 'relevant' with their corresponding labels and remove ${}
-                                                    if relevant:
-                                                        relevant = re.sub(r'\${(.*?)}', r'\1', relevant)  # Remove ${}
-                                                        for var_name, var_label in name_to_label.items():
-                                                            relevant = re.sub(rf"\b{var_name}\b", var_label, relevant)
-
-                                                            # Build question structure
-                                                            question_data = {
-                                                            'Heading': heading,
-                                                            'Name': name,
-                                                            'Path': path,
-                                                            'Type': row_type,
-                                                            'Hint': hint,
-                                                            'Relevant': relevant,
-                                                            'Constraint': constraint,
-                                                            'Required': required,
-                                                            'Choices': None,
-                                                            'Group_Level': len(group_stack),
-                                                            'Group': group_stack[-1] if group_stack else None
-                                                            }
-
-                                                            # Handle select_one or select_multiple with choices
-                                                            if 'select_one' in row_type or 'select_multiple' in row_type:
-                                                                list_name = row_type.split()[1] if len(row_type.split()) > 1 else None
-                                                                choices = choices_df[choices_df['list_name'] == list_name]
-                                                                choices_list = choices['label'].tolist()
-                                                                question_data['Choices'] = choices_list
-
-                                                                questions.append(question_data)
-
-                                                            return questions
-
-                                                            # Function to generate HTML for each question
-                                                            def generate_question_html(question):
-                                                                html = f"<div class='question-box'><h4 class='question-label'>{question['Heading']}</h4>"
-
-                                                                # Add additional elements with color coding
-                                                                if question['Hint']:
-                                                                    html += f"<p class='hint'><strong>Hint:</strong> {question['Hint']}</p>"
-                                                                    if question['Relevant']:
-                                                                        html += f"<p class='relevant'><strong>Relevant:</strong> {question['Relevant']}</p>"
-                                                                        if question['Constraint']:
-                                                                            html += f"<p class='constraint'><strong>Constraint:</strong> {question['Constraint']}</p>"
-                                                                            if question['Required']:
-                                                                                html += f"<p class='required'><strong>Required:</strong> {question['Required']}</p>"
-
-                                                                                # Add question type
-                                                                                html += f"<p class='type'><em>Type:</em> {question['Type']}</p>"
-
-                                                                                # Add choices if applicable
-                                                                                if question['Choices']:
-                                                                                    html += "<ul class='choices'>"
-                                                                                    for choice in question['Choices']:
-                                                                                        html += f"<li>{choice}</li>"
-                                                                                        html += "</ul>"
-
-                                                                                        html += "</div>"
-                                                                                    return html
-
-                                                                                    # Function to generate HTML document
-                                                                                    def save_to_html(questions, metadata, output_html):
-                                                                                        # HTML Structure
-                                                                                        html_content = f"""
-                                                                                        <html>
-                                                                                        <head>
-                                                                                        <title>{metadata['Form Title']}</title>
-                                                                                        <style>
-                                                                                        body {{
-                                                                                        font-family: 'Open Sans', sans-serif;
-                                                                                        background-color: #f9f9f9;
-                                                                                        color: #333;
-                                                                                        }}
-                                                                                        .sidebar {{
-                                                                                        width: 250px;
-                                                                                        float: left;
-                                                                                        background-color: #2c3e50;
-                                                                                        padding: 15px;
-                                                                                        border-right: 1px solid #ccc;
-                                                                                        height: 100%;
-                                                                                        position: fixed;
-                                                                                        color: white;
-                                                                                        }}
-                                                                                        .sidebar h2 {{
-                                                                                        font-size: 20px;
-                                                                                        color: #ecf0f1;
-                                                                                        text-align: center;
-                                                                                        margin-bottom: 20px;
-                                                                                        }}
-                                                                                        .sidebar ul {{
-                                                                                        padding-left: 0;
-                                                                                        list-style: none;
-                                                                                        }}
-                                                                                        .sidebar ul li {{
-                                                                                        padding: 10px;
-                                                                                        border-bottom: 1px solid #34495e;
-                                                                                        }}
-                                                                                        .sidebar ul li a {{
-                                                                                        color: #ecf0f1;
-                                                                                        text-decoration: none;
-                                                                                        }}
-                                                                                        .sidebar ul li:hover {{
-                                                                                        background-color: #34495e;
-                                                                                        }}
-                                                                                        .content {{
-                                                                                        margin-left: 270px;
-                                                                                        padding: 20px;
-                                                                                        }}
-                                                                                        h1, h2, h3 {{
-                                                                                        margin-bottom: 10px;
-                                                                                        }}
-                                                                                        .dropdown {{
-                                                                                        cursor: pointer;
-                                                                                        font-weight: bold;
-                                                                                        margin-bottom: 10px;
-                                                                                        background-color: #3498db;
-                                                                                        color: white;
-                                                                                        padding: 10px;
-                                                                                        border-radius: 5px;
-                                                                                        }}
-                                                                                        .dropdown-content {{
-                                                                                        display: block;  /* Uncollapsed by default */
-                                                                                        margin-left: 20px;
-                                                                                        border-left: 2px solid #ccc;
-                                                                                        padding-left: 10px;
-                                                                                        }}
-                                                                                        .question-box {{
-                                                                                        margin-bottom: 20px;
-                                                                                        padding: 15px;
-                                                                                        border: 1px solid #ccc;
-                                                                                        border-radius: 5px;
-                                                                                        background-color: white;
-                                                                                        }}
-                                                                                        .question-label {{
-                                                                                        color: red;
-                                                                                        margin-bottom: 10px;
-                                                                                        }}
-                                                                                        .hint {{
-                                                                                        color: green;
-                                                                                        }}
-                                                                                        .relevant {{
-                                                                                        color: blue;
-                                                                                        }}
-                                                                                        .constraint {{
-                                                                                        color: red;
-                                                                                        }}
-                                                                                        .required {{
-                                                                                        color: orange;
-                                                                                        }}
-                                                                                        .choices {{
-                                                                                        margin-left: 20px;
-                                                                                        }}
-                                                                                        ul {{
-                                                                                        list-style-type: none;
-                                                                                        }}
-                                                                                        ul li {{
-                                                                                        padding: 5px;
-                                                                                        border-bottom: 1px solid #ddd;
-                                                                                        }}
-                                                                                        ul li:hover {{
-                                                                                        background-color: #eee;
-                                                                                        }}
-                                                                                        </style>
-                                                                                        </head>
-                                                                                        <body>
-                                                                                        <div class="sidebar">
-                                                                                        <h2>Groups</h2>
-                                                                                        <ul>
-                                                                                        """
-
-                                                                                        # Sidebar for groups
-                                                                                        groups = {}
-                                                                                        for question in questions:
-                                                                                            if question['Group'] and question['Group'] not in groups:
-                                                                                                groups[question['Group']] = f"<li><a href='#{question['Group']}'>{question['Group']}</a></li>"
-
-                                                                                                for group in groups.values():
-                                                                                                    html_content += group
-
-                                                                                                    html_content += """
-                                                                                                    </ul>
-                                                                                                    </div>
-                                                                                                    <div class="content">
-                                                                                                    <h1>{metadata['Form Title']}</h1>
-                                                                                                    <h2>ID: {metadata['Form ID']}</h2>
-                                                                                                    <h2>Version: {metadata['Version']}</h2>
-                                                                                                    """
-
-                                                                                                    # Generate questions HTML with collapsible groups
-                                                                                                    current_group = None
-                                                                                                    for question in questions:
-                                                                                                        if question['Group'] != current_group:
-                                                                                                            if current_group is not None:
-                                                                                                                html_content += "</div>"  # Close previous group's dropdown content
-                                                                                                                current_group = question['Group']
-                                                                                                                html_content += f"<div class='dropdown'>{current_group}</div>"
-                                                                                                                html_content += f"<div class='dropdown-content' id='{current_group}'>"
-
-
-                                                                                                                # Add collapsible choices if applicable
-                                                                                                                if question['Choices']:
-                                                                                                                    html += "<div class='choices-container'><button class='choices-btn'>Show Choices</button><ul class='choices' style='display: none;'>"
-                                                                                                                    for choice in question['Choices']:
-                                                                                                                        html += f"<li>{choice}</li>"
-                                                                                                                        html += "</ul></div>"
-
-                                                                                                                        # Add question content
-                                                                                                                        html_content += generate_question_html(question)
-
-                                                                                                                        # Close last group
-                                                                                                                        html_content += "</div>"
-
-                                                                                                                        # Close HTML structure
-                                                                                                                        html_content += """
-                                                                                                                        </div>
-
-                                                                                                                        <script>
-                                                                                                                        document.querySelectorAll('.choices-btn').forEach(function(button) {
-                                                                                                                        button.addEventListener('click', function() {
-                                                                                                                        const choices = this.nextElementSibling;
-                                                                                                                        if (choices.style.display === 'none' || choices.style.display === '') {
-                                                                                                                        choices.style.display = 'block';
-                                                                                                                        this.innerHTML = 'Hide Choices';
-                                                                                                                        } else {
-                                                                                                                        choices.style.display = 'none';
-                                                                                                                        this.innerHTML = 'Show Choices';
-                                                                                                                        }
-                                                                                                                        });
-                                                                                                                        });
-                                                                                                                        </script>
-
-                                                                                                                        </body>
-                                                                                                                        </html>
-                                                                                                                        """
-
-                                                                                                                        # Write to the output HTML file
-                                                                                                                        with open(output_html, 'w') as file:
-                                                                                                                            file.write(html_content)
-
-                                                                                                                            def main():
-                                                                                                                                # Parse the command-line argument
-                                                                                                                                parser = argparse.ArgumentParser(description='Process ODK XLSX file to generate a data dictionary in HTML format with sidebar and dropdown menus.')
-                                                                                                                                parser.add_argument('file', type=str, help='Path to the ODK XLSX file')
-                                                                                                                                parser.add_argument('output', type=str, help='Output HTML file path')
-
-                                                                                                                                args = parser.parse_args()
-
-                                                                                                                                # Load the Excel file
-                                                                                                                                file_path = args.file
-                                                                                                                                xls = pd.ExcelFile(file_path)
-
-                                                                                                                                # Load the relevant sheets: survey and choices
-                                                                                                                                survey_df = pd.read_excel(xls, sheet_name='survey')
-                                                                                                                                choices_df = pd.read_excel(xls, sheet_name='choices')
-                                                                                                                                settings_df = pd.read_excel(xls, sheet_name='settings')
-
-                                                                                                                                # Generate the list of questions with group levels
-                                                                                                                                questions = process_survey(survey_df, choices_df)
-
-                                                                                                                                # Get metadata from settings sheet
-                                                                                                                                form_metadata = {
-                                                                                                                                'Form Title': settings_df.loc[0, 'form_title'],
-                                                                                                                                'Form ID': settings_df.loc[0, 'form_id'],
-                                                                                                                                'Version': settings_df.loc[0, 'version']
-                                                                                                                                }
-
-                                                                                                                                # Save the questions to an HTML document
-                                                                                                                                save_to_html(questions, form_metadata, args.output)
-
-                                                                                                                                if __name__ == '__main__':
-                                                                                                                                    main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()